@@ -0,0 +1,68 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(os.path.join(path_root, 'src'))
+
+from pyrepositories import DataSource, JsonTable, Entity, FieldBase, FieldTypes, FieldKeyTypes, EntityField
+from pyrepositories import AsyncDataSource
+
+
+fields = [
+    FieldBase('name', FieldTypes.STR, FieldKeyTypes.REQUIRED),
+    FieldBase('age', FieldTypes.INT, FieldKeyTypes.OPTIONAL, 0),
+]
+
+rows = 50_000
+tables = 4
+requests = 16
+
+
+async def measure_lag(done: asyncio.Event) -> float:
+    """Largest delay of a 1 ms timer while the queries run"""
+
+    worst = 0.0
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        worst = max(worst, time.perf_counter() - start - 0.001)
+    return worst
+
+
+async def run(datasource: DataSource, use_async: bool) -> tuple[float, float]:
+    async_datasource = AsyncDataSource(datasource, max_workers=tables)
+    done = asyncio.Event()
+    lag = asyncio.create_task(measure_lag(done))
+    start = time.perf_counter()
+
+    async def query(index: int):
+        table_name = f'table{index % tables}'
+        if use_async:
+            await async_datasource.get_all(table_name)
+        else:
+            datasource.get_all(table_name)
+        await asyncio.sleep(0)
+
+    await asyncio.gather(*(query(index) for index in range(requests)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    async_datasource.close()
+    return elapsed, await lag
+
+
+with tempfile.TemporaryDirectory() as store_path:
+    datasource = DataSource()
+    for index in range(tables):
+        table = JsonTable(f'table{index}', store_path, fields)
+        table.insert_many([Entity([EntityField(fields[0], f'user {row}'), EntityField(fields[1], row % 90)], row + 1)
+                           for row in range(rows)])
+        datasource.add_table(table)
+
+    for use_async in (False, True):
+        elapsed, lag = asyncio.run(run(datasource, use_async))
+        label = 'async' if use_async else 'sync'
+        print(f"{label:>5}: {requests} get_all over {tables} tables in {elapsed:.2f}s, worst event loop lag {lag * 1000:.1f} ms")
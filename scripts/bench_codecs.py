@@ -0,0 +1,51 @@
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(os.path.join(path_root, 'src'))
+
+from pyrepositories import Entity, FieldBase, FieldTypes, FieldKeyTypes, EntityField, JsonCodec, MsgpackCodec
+
+
+fields = [
+    FieldBase('name', FieldTypes.STR, FieldKeyTypes.REQUIRED),
+    FieldBase('email', FieldTypes.STR, FieldKeyTypes.UNIQUE),
+    FieldBase('age', FieldTypes.INT, FieldKeyTypes.OPTIONAL, 0),
+    FieldBase('score', FieldTypes.FLOAT, FieldKeyTypes.OPTIONAL, 0.0),
+    FieldBase('active', FieldTypes.BOOL, FieldKeyTypes.OPTIONAL, False),
+]
+
+rows = 100_000
+document = {'content': [
+    Entity([EntityField(fields[0], f'user {index}'), EntityField(fields[1], f'user{index}@example.com'),
+            EntityField(fields[2], index % 90), EntityField(fields[3], index / 7), EntityField(fields[4], index % 2 == 0)],
+           index + 1).serialize()
+    for index in range(rows)
+]}
+
+codecs = {'json': JsonCodec(use_orjson=False)}
+for name, create in (('orjson', lambda: JsonCodec(use_orjson=True)), ('msgpack', MsgpackCodec)):
+    try:
+        codecs[name] = create()
+    except ImportError as error:
+        print(f"{name}: skipped, {error}")
+
+with tempfile.TemporaryDirectory() as store_path:
+    baseline = None
+    for name, codec in codecs.items():
+        path = os.path.join(store_path, f'table.{codec.extension}')
+        start = time.perf_counter()
+        size = codec.save(path, document)
+        save = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = codec.load(path)
+        load = time.perf_counter() - start
+        assert loaded == document
+        if baseline is None:
+            baseline = (save, load, size)
+        print(f"{name:>8}: save {save * 1000:7.1f} ms ({baseline[0] / save:4.1f}x), "
+              f"load {load * 1000:7.1f} ms ({baseline[1] / load:4.1f}x), "
+              f"{size / 2**20:6.2f} MiB ({baseline[2] / size:4.1f}x) for {rows} rows")
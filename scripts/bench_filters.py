@@ -0,0 +1,58 @@
+import os
+import sys
+import timeit
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(os.path.join(path_root, 'src'))
+
+from pyrepositories import Entity, FieldBase, FieldTypes, FieldKeyTypes, EntityField, Filter, FilterCondition, FilterTypes, FilterCombination
+from pyrepositories.lib import filter_by_fields
+
+
+fields = [
+    FieldBase('name', FieldTypes.STR, FieldKeyTypes.REQUIRED),
+    FieldBase('age', FieldTypes.INT, FieldKeyTypes.OPTIONAL, 0),
+    FieldBase('status', FieldTypes.STR, FieldKeyTypes.OPTIONAL, 'new'),
+]
+
+rows = 100_000
+entities = [
+    Entity([
+        EntityField(fields[0], f'user {index}'),
+        EntityField(fields[1], index % 90),
+        EntityField(fields[2], ['new', 'active', 'banned'][index % 3]),
+    ], index + 1)
+    for index in range(rows)
+]
+
+filters = {
+    'equal': Filter([FilterCondition('status', 'active')]),
+    'and': Filter([
+        FilterCondition('age', 30, FilterTypes.GREATER_THAN),
+        FilterCondition('status', ['active', 'banned'], FilterTypes.IN),
+        FilterCondition('name', '7', FilterTypes.CONTAINS),
+    ]),
+    'or': Filter([
+        FilterCondition('age', 10, FilterTypes.LESS_THAN),
+        FilterCondition('name', '99', FilterTypes.CONTAINS),
+    ], FilterCombination.OR),
+}
+
+
+def interpreted(data: list[Entity], filter: Filter) -> list[Entity]:
+    """The per-row enum dispatch used before filters were compiled"""
+
+    result = []
+    for item in data:
+        results = [item.matches_condition(c.key, c.value, c.filter_type) for c in filter.conditions]
+        if (all if filter.combination == FilterCombination.AND else any)(results):
+            result.append(item)
+    return result
+
+
+for name, filter in filters.items():
+    assert interpreted(entities, filter) == filter_by_fields(entities, filter)
+    before = min(timeit.repeat(lambda: interpreted(entities, filter), number=1, repeat=5)) / rows * 1e9
+    after = min(timeit.repeat(lambda: filter_by_fields(entities, filter), number=1, repeat=5)) / rows * 1e9
+    print(f"{name:>6}: interpreted {before:7.1f} ns/row, compiled {after:7.1f} ns/row, {before / after:.1f}x")
@@ -0,0 +1,78 @@
+import os
+import sys
+import tracemalloc
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(os.path.join(path_root, 'src'))
+
+from pyrepositories import Entity, FieldBase, FieldTypes, FieldKeyTypes, EntityField, TableField
+
+
+fields = [
+    FieldBase('name', FieldTypes.STR, FieldKeyTypes.REQUIRED),
+    FieldBase('email', FieldTypes.STR, FieldKeyTypes.UNIQUE),
+    FieldBase('age', FieldTypes.INT, FieldKeyTypes.OPTIONAL, 0),
+    FieldBase('comment', FieldTypes.STR, FieldKeyTypes.OPTIONAL, ''),
+]
+
+rows = 100_000
+# Shared so that only the per-row structures are measured
+values = [(f'user {index}', f'user{index}@example.com', index % 90, '') for index in range(rows)]
+
+
+class LegacyEntityField:
+    """The per-cell layout used before entities shared a Schema"""
+
+    def __init__(self, field: FieldBase, value):
+        self.value = value
+        self.name = field.name
+        self.field_type = field.field_type
+        self.key_type = field.key_type
+        self.default = field.default
+
+
+class LegacyFieldValue:
+    def __init__(self, value, entity_id):
+        self.entity_id = entity_id
+        self.value = value
+
+
+class LegacyEntity:
+    def __init__(self, entity_fields: list[LegacyEntityField], id):
+        self.id = id
+        self.fields = {field.name: field for field in entity_fields}
+        self.errors = []
+
+
+def build_legacy():
+    entities = [LegacyEntity([LegacyEntityField(field, value) for field, value in zip(fields, row)], index)
+                for index, row in enumerate(values)]
+    table_values = [{index: LegacyFieldValue(row[position], index) for index, row in enumerate(values)}
+                    for position in range(len(fields))]
+    return entities, table_values
+
+
+def build_compact():
+    entities = [Entity([EntityField(field, value) for field, value in zip(fields, row)], index)
+                for index, row in enumerate(values)]
+    table_fields = [TableField(field) for field in fields]
+    for table_field in table_fields:
+        for entity in entities:
+            table_field.set_value(entity.id, entity.get_field_value(table_field.name))
+    return entities, table_fields
+
+
+def measure(build) -> int:
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+legacy = measure(build_legacy)
+compact = measure(build_compact)
+print(f"legacy:  {legacy / 2**20:7.1f} MiB per {rows} rows")
+print(f"compact: {compact / 2**20:7.1f} MiB per {rows} rows, {legacy / compact:.1f}x smaller")
@@ -0,0 +1,40 @@
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(os.path.join(path_root, 'src'))
+
+from pyrepositories import Entity, FieldBase, FieldTypes, FieldKeyTypes, EntityField, JsonTable, PagedTable
+
+
+fields = [
+    FieldBase('name', FieldTypes.STR, FieldKeyTypes.REQUIRED),
+    FieldBase('email', FieldTypes.STR, FieldKeyTypes.UNIQUE),
+    FieldBase('age', FieldTypes.INT, FieldKeyTypes.OPTIONAL, 0),
+]
+
+rows = 100_000
+lookups = 1000
+entities = [
+    Entity([EntityField(fields[0], f'user {index}'), EntityField(fields[1], f'user{index}@example.com'),
+            EntityField(fields[2], index % 90)], index + 1)
+    for index in range(rows)
+]
+wanted = random.Random(0).sample(range(1, rows + 1), lookups)
+
+with tempfile.TemporaryDirectory() as store_path:
+    for name, create in (('json', lambda: JsonTable('table', store_path, fields)),
+                         ('paged', lambda: PagedTable('table', store_path, fields))):
+        create().insert_many(entities)
+        start = time.perf_counter()
+        table = create()
+        opened = time.perf_counter() - start
+        start = time.perf_counter()
+        for entity_id in wanted:
+            assert table.get_by_id(entity_id).id == entity_id
+        lookup = (time.perf_counter() - start) / lookups
+        print(f"{name:>6}: open {opened * 1000:7.1f} ms, get_by_id {lookup * 1e6:9.1f} us for {rows} rows")
@@ -0,0 +1,246 @@
+"""Benchmarks every DataSource operation on JsonTable across table sizes
+
+Usage:
+    python scripts/bench_suite.py --sizes 1000 10000 --output results.json
+    python scripts/bench_suite.py --sizes 1000 10000 --compare results.json
+
+Wall time is measured without tracing. Peak memory is measured in an extra traced run of
+each operation, and the bytes written come from /proc/self/io, so they are only reported on Linux.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+path_root = Path(__file__).parents[1]
+sys.path.append(os.path.join(path_root, 'src'))
+
+from pyrepositories import DataSource, JsonTable, JsonStorageModes, Entity, EntityField, FieldBase, FieldTypes, FieldKeyTypes
+from pyrepositories import Filter, FilterCondition, FilterTypes, FilterCombination
+
+
+fields = [
+    FieldBase('name', FieldTypes.STR, FieldKeyTypes.REQUIRED),
+    FieldBase('email', FieldTypes.STR, FieldKeyTypes.UNIQUE),
+    FieldBase('age', FieldTypes.INT, FieldKeyTypes.OPTIONAL, 0),
+    FieldBase('active', FieldTypes.BOOL, FieldKeyTypes.OPTIONAL, False),
+]
+
+names = ['ann', 'bob', 'cid', 'dan', 'eve', 'fay']
+
+
+def make_entity(index: int, entity_id: int | None = None) -> Entity:
+    return Entity([
+        EntityField(fields[0], f'{names[index % len(names)]} {index}'),
+        EntityField(fields[1], f'user{index}@example.com'),
+        EntityField(fields[2], index % 90),
+        EntityField(fields[3], index % 3 == 0),
+    ], entity_id)
+
+
+def bytes_written() -> int | None:
+    """Bytes this process passed to write calls so far, None where /proc is not available"""
+
+    try:
+        with open('/proc/self/io', 'r') as io_file:
+            for line in io_file:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+class Workload:
+    """A JsonTable of the given size and the operations measured on it"""
+
+    def __init__(self, store_path: str, size: int, storage_mode: JsonStorageModes, cached: bool):
+        self.size = size
+        self.table = JsonTable('bench', store_path, fields, cached=cached, storage_mode=storage_mode)
+        self.table.insert_many([make_entity(index, index + 1) for index in range(size)])
+        self.datasource = DataSource()
+        self.datasource.add_table(self.table)
+        self.random = random.Random(size)
+        self.next_index = size
+        self.deletable = list(range(1, size + 1))
+        self.random.shuffle(self.deletable)
+
+    def operations(self) -> dict[str, Callable[[], Callable[[], object]]]:
+        """Each entry prepares its arguments and returns the call that is measured"""
+
+        datasource = self.datasource
+
+        def insert():
+            entity = self._new_entity()
+            return lambda: datasource.insert('bench', entity)
+
+        def insert_many():
+            entities = [self._new_entity() for _ in range(100)]
+            return lambda: datasource.insert_many('bench', entities)
+
+        def get_by_id():
+            entity_id = self.random.randint(1, self.size)
+            return lambda: datasource.get_by_id('bench', entity_id)
+
+        def get_unique():
+            email = f'user{self.random.randrange(self.size)}@example.com'
+            return lambda: datasource.get_unique('bench', 'email', email)
+
+        def get_by_filter():
+            filter = Filter([FilterCondition('age', self.random.randint(1, 89), FilterTypes.EQUAL),
+                             FilterCondition('name', 'ann', FilterTypes.CONTAINS)], FilterCombination.AND)
+            return lambda: datasource.get_by_filter('bench', filter)
+
+        def get_by_filters():
+            filters = [Filter([FilterCondition('age', self.random.randint(1, 89), FilterTypes.EQUAL)]),
+                       Filter([FilterCondition('name', 'bob', FilterTypes.CONTAINS),
+                               FilterCondition('active', True, FilterTypes.NOT_EQUAL)], FilterCombination.AND)]
+            return lambda: datasource.get_by_filters('bench', filters)
+
+        def update():
+            entity_id = self.random.randint(1, self.size)
+            entity = make_entity(entity_id - 1)
+            entity.set_field_value('age', (entity.get_field_value('age') + 1) % 90)
+            return lambda: datasource.update('bench', entity_id, entity)
+
+        def delete():
+            entity_id = self.deletable.pop()
+            return lambda: datasource.delete('bench', entity_id)
+
+        return {
+            'insert': insert,
+            'insert_many': insert_many,
+            'get_by_id': get_by_id,
+            'get_unique': get_unique,
+            'get_by_filter': get_by_filter,
+            'get_by_filters': get_by_filters,
+            'update': update,
+            'delete': delete,
+        }
+
+    def _new_entity(self) -> Entity:
+        self.next_index += 1
+        return make_entity(self.next_index)
+
+
+def measure(prepare: Callable[[], Callable[[], object]], repeat: int) -> dict:
+    times, written = [], []
+    # get_by_filter prints the filter, keep that out of the results and the timings
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            call = prepare()
+            before = bytes_written()
+            start = time.perf_counter()
+            call()
+            times.append(time.perf_counter() - start)
+            after = bytes_written()
+            if before is not None and after is not None:
+                written.append(after - before)
+
+        call = prepare()
+        tracemalloc.start()
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'runs': repeat,
+        'wall_ms': {
+            'min': min(times) * 1000,
+            'median': statistics.median(times) * 1000,
+            'mean': statistics.fmean(times) * 1000,
+        },
+        'peak_bytes': peak,
+        'bytes_written': statistics.median(written) if written else None,
+    }
+
+
+def run(sizes: list[int], repeat: int, storage_mode: JsonStorageModes, cached: bool,
+        operations: list[str] | None) -> list[dict]:
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as store_path:
+            start = time.perf_counter()
+            workload = Workload(store_path, size, storage_mode, cached)
+            print(f"{size} rows loaded in {time.perf_counter() - start:.1f}s")
+            for name, prepare in workload.operations().items():
+                if operations and name not in operations:
+                    continue
+                result = measure(prepare, repeat)
+                result.update({'size': size, 'operation': name})
+                results.append(result)
+                written = result['bytes_written']
+                print(f"  {name:<15} {result['wall_ms']['median']:10.3f} ms  "
+                      f"peak {result['peak_bytes'] / 2**20:8.2f} MiB  "
+                      f"written {'-' if written is None else f'{written / 2**20:.2f} MiB'}")
+    return results
+
+
+def compare(results: list[dict], baseline_path: str, threshold: float) -> list[str]:
+    """Operations whose median time grew by more than threshold (0.2 = 20%) against the baseline"""
+
+    with open(baseline_path, 'r') as baseline_file:
+        baseline = {(item['size'], item['operation']): item for item in json.load(baseline_file)['results']}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result['size'], result['operation']))
+        if previous is None:
+            continue
+        ratio = result['wall_ms']['median'] / max(previous['wall_ms']['median'], 1e-9)
+        print(f"{result['size']:>8} {result['operation']:<15} {ratio:6.2f}x")
+        if ratio > 1 + threshold:
+            regressions.append(f"{result['operation']} at {result['size']} rows is {ratio:.2f}x slower")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--operations', nargs='+', help="Only run these operations")
+    parser.add_argument('--storage-mode', choices=[mode.name.lower() for mode in JsonStorageModes], default='snapshot')
+    parser.add_argument('--cached', action='store_true')
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="Baseline JSON file written by an earlier run")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    storage_mode = JsonStorageModes[args.storage_mode.upper()]
+    results = run(args.sizes, args.repeat, storage_mode, args.cached, args.operations)
+
+    if args.output:
+        report = {
+            'meta': {
+                'created': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'storage_mode': storage_mode.name,
+                'cached': args.cached,
+            },
+            'results': results,
+        }
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(os.path.join(path_root, 'src'))
+
+from pyrepositories import DataSource, JsonTable, SqliteTable, PagedTable, ShardedTable
+from pyrepositories import Entity, FieldBase, FieldTypes, FieldKeyTypes, EntityField
+
+
+# Ids inserted explicitly in one session must never be handed out by the id sequence of a later session
+
+fields = [FieldBase('name', FieldTypes.STR, FieldKeyTypes.REQUIRED)]
+
+
+def make_entity(name: str, entity_id: int | None = None) -> Entity:
+    return Entity([EntityField(fields[0], name)], entity_id)
+
+
+def open_table(kind: str, store_path: str):
+    if kind == 'json':
+        return JsonTable('json', store_path, fields)
+    if kind == 'sqlite':
+        return SqliteTable('users', os.path.join(store_path, 'users.db'), fields)
+    if kind == 'paged':
+        return PagedTable('paged', store_path, fields)
+    return ShardedTable('sharded', store_path, fields, shards=4)
+
+
+def session(kind: str, store_path: str, auto_increment: bool = True) -> tuple[DataSource, str]:
+    datasource = DataSource(auto_increment=auto_increment)
+    table = open_table(kind, store_path)
+    datasource.add_table(table)
+    return datasource, table.get_name()
+
+
+def check(kind: str, store_path: str) -> Exception | None:
+    try:
+        first, name = session(kind, store_path)
+        for row in range(3):
+            first.insert(name, make_entity(f'auto {row}'))
+        # Past the block of ids the first session reserved
+        explicit = max(entity.id for entity in first.get_all(name)) + 200
+
+        second, _ = session(kind, store_path, auto_increment=False)
+        second.insert(name, make_entity('explicit', explicit))
+
+        third, _ = session(kind, store_path)
+        inserted = third.insert(name, make_entity('auto again'))
+        if inserted.id <= explicit:
+            return AssertionError(f"id {inserted.id} was handed out after {explicit} was inserted")
+    except Exception as error:
+        return error
+    return None
+
+
+failed = False
+for kind in ('json', 'sqlite', 'paged', 'sharded'):
+    with tempfile.TemporaryDirectory() as store_path:
+        error = check(kind, store_path)
+    failed = failed or error is not None
+    print(f"{kind:>8}: " + ('ok' if error is None else repr(error)))
+sys.exit(1 if failed else 0)
@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(os.path.join(path_root, 'src'))
+
+from pyrepositories import JsonTable, SqliteTable, ColumnarTable, PagedTable, ShardedTable
+from pyrepositories import Entity, FieldBase, FieldTypes, FieldKeyTypes, EntityField, Filter, FilterCondition, FilterTypes
+
+
+# One thread writes while several threads read the same table, any exception in a reader is a failure
+
+fields = [
+    FieldBase('name', FieldTypes.STR, FieldKeyTypes.UNIQUE),
+    FieldBase('age', FieldTypes.INT, FieldKeyTypes.OPTIONAL, 0),
+]
+
+batches = 200
+batch_size = 50
+readers = 4
+
+
+def make_entity(row: int) -> Entity:
+    return Entity([EntityField(fields[0], f'user {row}'), EntityField(fields[1], row % 90)], row + 1)
+
+
+def check(table) -> list[Exception]:
+    errors = []
+    done = threading.Event()
+    adults = Filter([FilterCondition('age', 18, FilterTypes.GREATER_THAN_OR_EQUAL)])
+
+    def write():
+        try:
+            for batch in range(batches):
+                start = batch * batch_size
+                table.insert_many([make_entity(row) for row in range(start, start + batch_size)])
+                if batch % 3 == 0:
+                    table.delete_many(list(range(start + 1, start + batch_size // 2)))
+                if batch % 50 == 49:
+                    table.clear()
+        except Exception as error:
+            errors.append(error)
+        finally:
+            done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                table.get_all()
+                table.get_by_filter(adults)
+                table.count(adults)
+                table.aggregate('age', 'sum')
+                table.get_by_id(1)
+                list(table.iter_all())
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+with tempfile.TemporaryDirectory() as store_path:
+    tables = [
+        JsonTable('json', store_path, fields, cached=True),
+        SqliteTable('users', os.path.join(store_path, 'users.db'), fields),
+        ColumnarTable('columnar', fields, capacity=64),
+        PagedTable('paged', store_path, fields),
+        ShardedTable('sharded', store_path, fields, shards=4),
+    ]
+    failed = False
+    for table in tables:
+        errors = check(table)
+        failed = failed or bool(errors)
+        print(f"{type(table).__name__:>13}: {len(errors)} errors" + (f", first: {errors[0]!r}" if errors else ''))
+    sys.exit(1 if failed else 0)
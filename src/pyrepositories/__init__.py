@@ -1,9 +1,19 @@
 from .datatable import DataTable
-from .lib import Entity, IdTypes, FieldKeyTypes, FieldBase, FieldValue, FieldTypes, TableField, EntityField
+from .lib import Entity, IdTypes, FieldKeyTypes, FieldBase, FieldValue, FieldTypes, TableField, EntityField, Schema, RowDecoder, LazyEntity
 from .lib import FilterTypes, Filter, FilterCondition, FilterCombination
 from .datasource import DataSource
-from .json_repository import JsonTable
+from .async_datasource import AsyncDataSource, AsyncDataTable
+from .metrics import Observer, NullObserver, MetricsAggregator, OperationMetrics
+from .scan import ParallelScanner
+from .aggregate import AggregateFunctions
+from .json_repository import JsonTable, JsonStorageModes
+from .codec import Codec, JsonCodec, MsgpackCodec, convert_file
+from .paged_repository import PagedTable
+from .sharded_repository import ShardedTable
 from .pg_repository import PgTable
+from .columnar_repository import ColumnarTable
+from .sqlite_repository import SqliteTable
 
-__all__ = ['DataTable', 'Entity', 'IdTypes', 'FieldKeyTypes', 'FieldBase', 'FieldValue', 'FieldTypes', 'DataSource',
-           'JsonTable', 'PgTable', 'TableField', 'EntityField', 'FilterTypes', 'Filter', 'FilterCondition', 'FilterCombination']
+__all__ = ['DataTable', 'Entity', 'IdTypes', 'FieldKeyTypes', 'FieldBase', 'FieldValue', 'FieldTypes', 'DataSource', 'AsyncDataSource', 'AsyncDataTable',
+           'Observer', 'NullObserver', 'MetricsAggregator', 'OperationMetrics', 'ParallelScanner', 'AggregateFunctions',
+           'JsonTable', 'JsonStorageModes', 'Codec', 'JsonCodec', 'MsgpackCodec', 'convert_file', 'PagedTable', 'ShardedTable', 'PgTable', 'ColumnarTable', 'SqliteTable', 'TableField', 'EntityField', 'Schema', 'RowDecoder', 'LazyEntity', 'FilterTypes', 'Filter', 'FilterCondition', 'FilterCombination']
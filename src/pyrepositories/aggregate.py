@@ -0,0 +1,132 @@
+from typing import Any, Iterable
+from enum import Enum
+
+
+class AggregateFunctions(Enum):
+    COUNT = 'count'
+    SUM = 'sum'
+    MIN = 'min'
+    MAX = 'max'
+    AVG = 'avg'
+
+
+class Accumulator:
+    """Running result of one aggregate function, None values are skipped like in SQL
+
+    COUNT and SUM are 0 without values, MIN, MAX and AVG are None. Use Accumulator.of() to get the
+    accumulator of a function.
+    """
+
+    __slots__ = ('count', 'value')
+
+    def __init__(self):
+        self.count = 0
+        self.value = None  # type: Any
+
+    @staticmethod
+    def of(function: AggregateFunctions) -> 'Accumulator':
+        return _ACCUMULATORS[function]()
+
+    def add(self, value: Any):
+        if value is not None:
+            self.count += 1
+
+    def result(self) -> Any:
+        return self.count
+
+
+class _Sum(Accumulator):
+    __slots__ = ()
+
+    def add(self, value: Any):
+        if value is not None:
+            self.count += 1
+            self.value = value if self.value is None else self.value + value
+
+    def result(self) -> Any:
+        return self.value if self.count else 0
+
+
+class _Avg(_Sum):
+    __slots__ = ()
+
+    def result(self) -> Any:
+        return self.value / self.count if self.count else None
+
+
+class _Min(Accumulator):
+    __slots__ = ()
+
+    def add(self, value: Any):
+        if value is not None and (self.value is None or value < self.value):
+            self.value = value
+
+    def result(self) -> Any:
+        return self.value
+
+
+class _Max(_Min):
+    __slots__ = ()
+
+    def add(self, value: Any):
+        if value is not None and (self.value is None or value > self.value):
+            self.value = value
+
+
+_ACCUMULATORS = {
+    AggregateFunctions.COUNT: Accumulator,
+    AggregateFunctions.SUM: _Sum,
+    AggregateFunctions.AVG: _Avg,
+    AggregateFunctions.MIN: _Min,
+    AggregateFunctions.MAX: _Max,
+}
+
+
+def aggregate_values(values: Iterable[Any], function: AggregateFunctions) -> Any:
+    """Aggregate a stream of values with the builtins, with the same results as an Accumulator"""
+
+    present = (value for value in values if value is not None)
+    if function == AggregateFunctions.COUNT:
+        return sum(1 for _ in present)
+    if function == AggregateFunctions.SUM:
+        return sum(present)
+    if function == AggregateFunctions.MIN:
+        return min(present, default=None)
+    if function == AggregateFunctions.MAX:
+        return max(present, default=None)
+    accumulator = Accumulator.of(function)
+    for value in present:
+        accumulator.add(value)
+    return accumulator.result()
+
+
+def group_values(rows: Iterable[tuple], aggregates: list[tuple[str, AggregateFunctions]]) -> dict[Any, dict[str, Any]]:
+    """Aggregate rows of (group value, value of every aggregate) into {group value: {aggregate name: result}}"""
+
+    groups = {}  # type: dict[Any, list[Accumulator]]
+    if len(aggregates) == 1:
+        # The common case of a single aggregate, without the inner loop
+        function = aggregates[0][1]
+        for group, value in rows:
+            accumulator = groups.get(group)
+            if accumulator is None:
+                accumulator = groups[group] = [Accumulator.of(function)]
+            accumulator[0].add(value)
+    else:
+        for row in rows:
+            accumulators = groups.get(row[0])
+            if accumulators is None:
+                accumulators = groups[row[0]] = [Accumulator.of(function) for _, function in aggregates]
+            for accumulator, value in zip(accumulators, row[1:]):
+                accumulator.add(value)
+    return {group: {name: accumulator.result() for (name, _), accumulator in zip(aggregates, accumulators)}
+            for group, accumulators in groups.items()}
+
+
+def normalize_aggregates(aggregates: dict[str, tuple[str, AggregateFunctions | str]] | None
+                         ) -> list[tuple[str, str, AggregateFunctions]]:
+    """(result name, field, function) for every aggregate of group_by, a count of the entities by default"""
+
+    if aggregates is None:
+        return [('count', 'id', AggregateFunctions.COUNT)]
+    return [(name, field, AggregateFunctions(function)) for name, (field, function) in aggregates.items()]
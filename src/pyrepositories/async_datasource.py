@@ -0,0 +1,191 @@
+from typing import Any, Callable
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from .datasource import DataSource
+from .datatable import DataTable
+from .lib import Entity, Filter
+from .aggregate import AggregateFunctions
+import asyncio
+
+
+class AsyncDataTable:
+    """Awaitable view of a DataTable, the blocking calls run in an executor
+
+    Reads run at the same time, the table lock keeps them consistent. Writes to the same table are
+    serialized before they reach the executor so they do not hold several of its threads waiting on the table lock.
+    """
+
+    def __init__(self, table: DataTable, executor: Executor):
+        self.table = table
+        self._executor = executor
+        self._lock = asyncio.Lock()
+
+    def get_name(self) -> str:
+        return self.table.get_name()
+
+    async def get_all(self, fields: list[str] | None = None) -> list[Entity] | list[dict[str, Any]]:
+        return await self._run(self.table.get_all, fields=fields)
+
+    async def get_by_id(self, entity_id: int | str, fields: list[str] | None = None) -> Entity | dict[str, Any] | None:
+        return await self._run(self.table.get_by_id, entity_id, fields=fields)
+
+    async def get_unique(self, key: str, value: Any) -> Entity | None:
+        return await self._run(self.table.get_unique, key, value)
+
+    async def get_by_filter(self, filters: Filter, fields: list[str] | None = None) -> list[Entity] | list[dict[str, Any]]:
+        return await self._run(self.table.get_by_filter, filters, fields=fields)
+
+    async def count(self, filters: Filter | None = None) -> int:
+        return await self._run(self.table.count, filters)
+
+    async def aggregate(self, field: str, function: AggregateFunctions | str, filters: Filter | None = None) -> Any:
+        return await self._run(self.table.aggregate, field, function, filters)
+
+    async def group_by(self, field: str, aggregates: dict[str, tuple[str, AggregateFunctions | str]] | None = None,
+                       filters: Filter | None = None) -> dict[Any, dict[str, Any]]:
+        return await self._run(self.table.group_by, field, aggregates, filters)
+
+    async def insert(self, data: Entity) -> Entity | None:
+        return await self._write(self.table.insert, data)
+
+    async def insert_many(self, data: list[Entity]) -> list[Entity] | None:
+        return await self._write(self.table.insert_many, data)
+
+    async def update(self, entity_id: int | str, data: Entity) -> Entity | None:
+        return await self._write(self.table.update, entity_id, data)
+
+    async def update_many(self, data: list[Entity]) -> list[Entity] | None:
+        return await self._write(self.table.update_many, data)
+
+    async def update_where(self, filters: Filter, changes: dict[str, Any]) -> int:
+        return await self._write(self.table.update_where, filters, changes)
+
+    async def delete(self, entity_id: int | str) -> bool:
+        return await self._write(self.table.delete, entity_id)
+
+    async def delete_many(self, entity_ids: list[int | str]) -> int:
+        return await self._write(self.table.delete_many, entity_ids)
+
+    async def delete_where(self, filters: Filter) -> int:
+        return await self._write(self.table.delete_where, filters)
+
+    async def clear(self) -> bool:
+        return await self._write(self.table.clear)
+
+    async def _run(self, function: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(function, *args, **kwargs))
+
+    async def _write(self, function: Callable, *args, **kwargs) -> Any:
+        async with self._lock:
+            return await self._run(function, *args, **kwargs)
+
+
+class AsyncDataSource:
+    """Awaitable counterpart of DataSource for asyncio applications
+
+    File I/O and decoding run in a bounded thread pool so the event loop stays responsive.
+    """
+
+    def __init__(self, datasource: DataSource | None = None, max_workers: int = 4, executor: Executor | None = None):
+        self.datasource = datasource or DataSource()
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers, thread_name_prefix='pyrepositories')
+        self._tables = {}  # type: dict[str, AsyncDataTable]
+
+    def add_table(self, table: DataTable):
+        self.datasource.add_table(table)
+
+    def drop(self, table_name: str) -> bool:
+        self._tables.pop(table_name, None)
+        return self.datasource.drop(table_name)
+
+    def get_table(self, name: str) -> AsyncDataTable | None:
+        table = self.datasource.get_table(name)
+        if table is None:
+            return None
+        async_table = self._tables.get(name)
+        if async_table is None or async_table.table is not table:
+            async_table = AsyncDataTable(table, self._executor)
+            self._tables[name] = async_table
+        return async_table
+
+    async def get_all(self, table_name: str, fields: list[str] | None = None) -> list[Entity] | list[dict[str, Any]]:
+        return await self._run(table_name, self.datasource.get_all, table_name, fields)
+
+    async def get_by_id(self, table_name: str, id: int | str,
+                        fields: list[str] | None = None) -> Entity | dict[str, Any] | None:
+        return await self._run(table_name, self.datasource.get_by_id, table_name, id, fields)
+
+    async def get_by_filter(self, table_name: str, filter: Filter,
+                            fields: list[str] | None = None) -> list[Entity] | list[dict[str, Any]]:
+        return await self._run(table_name, self.datasource.get_by_filter, table_name, filter, fields)
+
+    async def get_by_filters(self, table_name: str, filters: list[Filter]) -> list[Entity]:
+        return await self._run(table_name, self.datasource.get_by_filters, table_name, filters)
+
+    async def get_unique(self, table_name: str, field_name: str, value: Any) -> Entity | None:
+        return await self._run(table_name, self.datasource.get_unique, table_name, field_name, value)
+
+    async def count(self, table_name: str, filter: Filter | None = None) -> int:
+        return await self._run(table_name, self.datasource.count, table_name, filter)
+
+    async def aggregate(self, table_name: str, field: str, function: AggregateFunctions | str,
+                        filter: Filter | None = None) -> Any:
+        return await self._run(table_name, self.datasource.aggregate, table_name, field, function, filter)
+
+    async def group_by(self, table_name: str, field: str,
+                       aggregates: dict[str, tuple[str, AggregateFunctions | str]] | None = None,
+                       filter: Filter | None = None) -> dict[Any, dict[str, Any]]:
+        return await self._run(table_name, self.datasource.group_by, table_name, field, aggregates, filter)
+
+    async def insert(self, table_name: str, data: Entity):
+        return await self._write(table_name, self.datasource.insert, table_name, data)
+
+    async def insert_many(self, table_name: str, data: list[Entity]):
+        return await self._write(table_name, self.datasource.insert_many, table_name, data)
+
+    async def update(self, table_name: str, id: int | str, data: Entity):
+        return await self._write(table_name, self.datasource.update, table_name, id, data)
+
+    async def update_many(self, table_name: str, data: list[Entity]):
+        return await self._write(table_name, self.datasource.update_many, table_name, data)
+
+    async def update_where(self, table_name: str, filter: Filter, changes: dict[str, Any]) -> int:
+        return await self._write(table_name, self.datasource.update_where, table_name, filter, changes)
+
+    async def delete(self, table_name: str, id: int | str):
+        return await self._write(table_name, self.datasource.delete, table_name, id)
+
+    async def delete_many(self, table_name: str, ids: list[int | str]):
+        return await self._write(table_name, self.datasource.delete_many, table_name, ids)
+
+    async def delete_where(self, table_name: str, filter: Filter) -> int:
+        return await self._write(table_name, self.datasource.delete_where, table_name, filter)
+
+    async def clear(self, table_name: str):
+        return await self._write(table_name, self.datasource.clear, table_name)
+
+    def close(self):
+        if self._owns_executor:
+            self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    async def _run(self, table_name: str, function: Callable, *args) -> Any:
+        table = self.get_table(table_name)
+        if table is None:
+            # Let the DataSource method report the missing table the way it does synchronously
+            return function(*args)
+        return await table._run(function, *args)
+
+    async def _write(self, table_name: str, function: Callable, *args) -> Any:
+        table = self.get_table(table_name)
+        if table is None:
+            return function(*args)
+        return await table._write(function, *args)
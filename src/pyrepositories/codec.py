@@ -0,0 +1,156 @@
+from typing import Callable
+from operator import itemgetter
+from .concurrency import atomic_write, paused_gc
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec:
+    """Turns the document of a file table, {'content': [row, ...]}, into bytes and back"""
+
+    name = ''
+    extension = ''
+
+    def encode(self, document: dict) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: bytes) -> dict:
+        raise NotImplementedError
+
+    def load(self, path: str) -> dict:
+        with open(path, 'rb') as file:
+            data = file.read()
+        # Decoding allocates a container per row, collecting in between only slows it down
+        with paused_gc():
+            return self.decode(data)
+
+    def save(self, path: str, document: dict) -> int:
+        """Replace the file atomically and return the number of bytes written"""
+
+        data = self.encode(document)
+        atomic_write(path, data)
+        return len(data)
+
+
+class JsonCodec(Codec):
+    """JSON text, encoded with orjson when it is installed and with the json module otherwise
+
+    Both produce files the other can read, so a table can move between machines with and without orjson.
+    """
+
+    name = 'json'
+    extension = 'json'
+
+    def __init__(self, use_orjson: bool | None = None):
+        if use_orjson and orjson is None:
+            raise ImportError("orjson is not installed, install pyrepositories[fast]")
+        self.use_orjson = orjson is not None if use_orjson is None else use_orjson
+
+    def encode(self, document: dict) -> bytes:
+        if self.use_orjson:
+            return orjson.dumps(document, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(document).encode('utf-8')
+
+    def decode(self, data: bytes) -> dict:
+        if self.use_orjson:
+            return orjson.loads(data)
+        return json.loads(data)
+
+
+class MsgpackCodec(Codec):
+    """Compact binary rows, the field names are stored once in a header instead of in every row
+
+    Rows holding exactly the header fields are stored as value lists in field order, any other
+    row is stored as a map so no information is lost.
+    """
+
+    name = 'msgpack'
+    extension = 'msgpack'
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("msgpack is not installed, install pyrepositories[fast]")
+
+    def encode(self, document: dict) -> bytes:
+        content = document.get('content') or []
+        names = list(dict.fromkeys(['id'] + [name for item in content for name in item]))
+        width = len(names)
+        values = itemgetter(*names) if width > 1 else lambda item: (item[names[0]],)
+        rows = []
+        for item in content:
+            if len(item) == width:
+                try:
+                    rows.append(values(item))
+                    continue
+                except KeyError:
+                    pass
+            rows.append(item)
+        header = {key: value for key, value in document.items() if key != 'content'}
+        return msgpack.packb({'fields': names, 'rows': rows, 'document': header}, use_bin_type=True)
+
+    def decode(self, data: bytes) -> dict:
+        packed = msgpack.unpackb(data, raw=False, strict_map_key=False)
+        build = _row_builder(packed['fields'])
+        content = [build(row) if isinstance(row, list) else row for row in packed['rows']]
+        document = packed.get('document') or {}
+        document['content'] = content
+        return document
+
+
+def _row_builder(names: list[str]) -> Callable[[list], dict]:
+    """A function turning a value list into a row, a generated dict display is much faster than dict(zip())"""
+
+    items = ', '.join(f'{name!r}: row[{position}]' for position, name in enumerate(names))
+    namespace = {}
+    exec(f'def build(row):\n    return {{{items}}}', namespace)
+    return namespace['build']
+
+
+_CODECS = {
+    'json': JsonCodec,
+    'msgpack': MsgpackCodec,
+}
+
+
+def get_codec(codec: Codec | str | None) -> Codec:
+    """A codec instance for a codec or its name, JSON when None"""
+
+    if isinstance(codec, Codec):
+        return codec
+    codec_class = _CODECS.get(codec or 'json')
+    if codec_class is None:
+        raise ValueError(f"Invalid codec {codec}, expected one of {', '.join(_CODECS)}")
+    return codec_class()
+
+
+def codec_for_path(path: str) -> Codec:
+    extension = os.path.splitext(path)[1].lstrip('.')
+    for codec_class in _CODECS.values():
+        if codec_class.extension == extension:
+            return codec_class()
+    raise ValueError(f"No codec for the extension of {path}")
+
+
+def convert_file(source_path: str, target_path: str, source_codec: Codec | str | None = None,
+                 target_codec: Codec | str | None = None) -> int:
+    """Rewrite a table file in another format, the codecs default to the ones of the file extensions
+
+    Compact the table first when it uses JsonStorageModes.LOG, the log is not converted.
+    Returns the number of rows converted.
+    """
+
+    source = get_codec(source_codec) if source_codec else codec_for_path(source_path)
+    target = get_codec(target_codec) if target_codec else codec_for_path(target_path)
+    document = source.load(source_path)
+    target.save(target_path, document)
+    return len(document.get('content') or [])
@@ -0,0 +1,415 @@
+from typing import Any, Callable, Container, Iterator
+from .datatable import DataTable, cached_query, projected
+from .lib import Entity, FieldBase, FieldTypes, Filter, FilterCondition, FilterCombination, FilterTypes
+from .metrics import current_metrics
+from .concurrency import reading, writing
+from .aggregate import AggregateFunctions
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is an optional dependency
+    np = None
+
+
+_NUMERIC_TYPES = {
+    FieldTypes.INT: 'int64',
+    FieldTypes.FLOAT: 'float64',
+    FieldTypes.BOOL: 'bool',
+}
+
+
+def _safe(test: Callable[[Any], bool]) -> Callable[[Any], bool]:
+    def wrapped(value: Any) -> bool:
+        try:
+            return bool(test(value))
+        except TypeError:
+            return False
+    return wrapped
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, str)
+
+
+class _Column:
+    """Values of one field stored in a NumPy object array, used for the types without a native dtype"""
+
+    def __init__(self, field: FieldBase, capacity: int):
+        self.field = field
+        self.data = np.empty(capacity, dtype=object)
+
+    def grow(self, capacity: int):
+        data = np.empty(capacity, dtype=self.data.dtype)
+        data[:len(self.data)] = self.data
+        self.data = data
+
+    def compact(self, positions):
+        self.data[:len(positions)] = self.data[positions]
+
+    def check(self, value: Any):
+        """Raise a ValueError when set() could not store the value"""
+
+    def set(self, position: int, value: Any):
+        self.data[position] = value
+
+    def get(self, position: int) -> Any:
+        return self.data[position]
+
+    def mask(self, condition: FilterCondition, size: int):
+        test = _safe(condition.compile_test())
+        return np.fromiter((test(value) for value in self.data[:size]), dtype=bool, count=size)
+
+
+class _NumericColumn(_Column):
+    """INT, FLOAT and BOOL values in a native array with a separate null mask"""
+
+    def __init__(self, field: FieldBase, capacity: int):
+        super().__init__(field, capacity)
+        self.data = np.zeros(capacity, dtype=_NUMERIC_TYPES[field.field_type])
+        self.nulls = np.zeros(capacity, dtype=bool)
+
+    def grow(self, capacity: int):
+        super().grow(capacity)
+        nulls = np.zeros(capacity, dtype=bool)
+        nulls[:len(self.nulls)] = self.nulls
+        self.nulls = nulls
+
+    def compact(self, positions):
+        super().compact(positions)
+        self.nulls[:len(positions)] = self.nulls[positions]
+
+    def check(self, value: Any):
+        if value is None:
+            return
+        try:
+            # Only store values that read back equal, numpy would truncate 1.5 and parse '5' silently
+            stored = None if isinstance(value, (str, bytes)) else self.data.dtype.type(value)
+        except (TypeError, ValueError, OverflowError):
+            stored = None
+        if stored is None or (stored != value and stored == stored):
+            raise ValueError(f"Value {value!r} is not valid for field {self.field.name}")
+
+    def set(self, position: int, value: Any):
+        self.nulls[position] = value is None
+        self.data[position] = 0 if value is None else value
+
+    def get(self, position: int) -> Any:
+        return None if self.nulls[position] else self.data[position].item()
+
+    def mask(self, condition: FilterCondition, size: int):
+        data, nulls = self.data[:size], self.nulls[:size]
+        value, filter_type = condition.value, condition.filter_type
+        if filter_type in (FilterTypes.IS_NULL, FilterTypes.IS_NOT_NULL):
+            return nulls.copy() if filter_type == FilterTypes.IS_NULL else ~nulls
+        if filter_type in (FilterTypes.IN, FilterTypes.NOT_IN) and isinstance(value, list) \
+                and all(_is_number(item) for item in value):
+            found = np.isin(data, value) & ~nulls
+            return found if filter_type == FilterTypes.IN else ~found
+        if not _is_number(value):
+            return self._python_mask(condition, size)
+        if filter_type == FilterTypes.EQUAL:
+            return (data == value) & ~nulls
+        if filter_type == FilterTypes.NOT_EQUAL:
+            return (data != value) | nulls
+        if filter_type == FilterTypes.GREATER_THAN:
+            return (data > value) & ~nulls
+        if filter_type == FilterTypes.LESS_THAN:
+            return (data < value) & ~nulls
+        if filter_type == FilterTypes.GREATER_THAN_OR_EQUAL:
+            return (data >= value) & ~nulls
+        if filter_type == FilterTypes.LESS_THAN_OR_EQUAL:
+            return (data <= value) & ~nulls
+        return self._python_mask(condition, size)
+
+    def _python_mask(self, condition: FilterCondition, size: int):
+        test = _safe(condition.compile_test())
+        return np.fromiter((test(self.get(position)) for position in range(size)), dtype=bool, count=size)
+
+
+class _DictionaryColumn(_Column):
+    """STR values stored as int32 codes into a list of distinct strings, -1 is None
+
+    Conditions are evaluated once per distinct string and mapped back to the rows through the codes.
+    """
+
+    def __init__(self, field: FieldBase, capacity: int):
+        super().__init__(field, capacity)
+        self.data = np.full(capacity, -1, dtype='int32')
+        self.dictionary = []  # type: list[str]
+        self.codes = {}  # type: dict[str, int]
+
+    def grow(self, capacity: int):
+        data = np.full(capacity, -1, dtype='int32')
+        data[:len(self.data)] = self.data
+        self.data = data
+
+    def check(self, value: Any):
+        try:
+            hash(value)
+        except TypeError:
+            raise ValueError(f"Value {value!r} is not valid for field {self.field.name}") from None
+
+    def set(self, position: int, value: Any):
+        if value is None:
+            self.data[position] = -1
+            return
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.dictionary)
+            self.dictionary.append(value)
+            self.codes[value] = code
+        self.data[position] = code
+
+    def get(self, position: int) -> Any:
+        code = self.data[position]
+        return None if code < 0 else self.dictionary[code]
+
+    def mask(self, condition: FilterCondition, size: int):
+        test = _safe(condition.compile_test())
+        matching = [code for code, value in enumerate(self.dictionary) if test(value)]
+        if test(None):
+            matching.append(-1)
+        return np.isin(self.data[:size], matching)
+
+
+def _make_column(field: FieldBase, capacity: int) -> _Column:
+    if field.field_type in _NUMERIC_TYPES:
+        return _NumericColumn(field, capacity)
+    if field.field_type == FieldTypes.STR:
+        return _DictionaryColumn(field, capacity)
+    return _Column(field, capacity)
+
+
+class ColumnarTable(DataTable):
+    """In-memory table keeping each field in a NumPy array
+
+    Filters are evaluated as boolean masks over whole columns and entities are only built for the
+    matching rows. Requires numpy (pip install pyrepositories[columnar]).
+    """
+
+    def __init__(self, name: str, fields: list[FieldBase], capacity: int = 1024):
+        if np is None:
+            raise ImportError("ColumnarTable requires numpy, install pyrepositories[columnar]")
+        super().__init__(name, fields)
+        self._capacity = max(capacity, 1)
+        self._size = 0
+        self._ids = np.empty(self._capacity, dtype=object)
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        self._positions = {}  # type: dict[int | str, int]
+        self._columns = {field.name: _make_column(field, self._capacity) for field in fields}
+
+    @projected
+    @reading
+    def get_all(self) -> list[Entity]:
+        return self._build_entities(np.flatnonzero(self._alive[:self._size]))
+
+    def iter_all(self) -> Iterator[Entity]:
+        """Build the entities one at a time, entities deleted while iterating are skipped"""
+
+        with self.read_lock():
+            entity_ids = self._ids[np.flatnonzero(self._alive[:self._size])].tolist()
+        yield from self._iter_ids(entity_ids)
+
+    @projected
+    @reading
+    def get_by_id(self, entity_id: int | str) -> Entity | None:
+        position = self._positions.get(entity_id)
+        if position is None:
+            return None
+        return self._build_entity(position)
+
+    @projected
+    @cached_query
+    @reading
+    def get_by_filter(self, filters: Filter) -> list[Entity]:
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.rows_scanned += self._size
+        return self._build_entities(np.flatnonzero(self.mask(filters)))
+
+    @cached_query
+    @reading
+    def get_by_filters(self, filters: list[Filter]) -> list[Entity]:
+        result = np.zeros(self._size, dtype=bool)
+        for filter in filters:
+            result |= self.mask(filter)
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.rows_scanned += self._size
+        return self._build_entities(np.flatnonzero(result))
+
+    @reading
+    def count(self, filters: Filter | None = None) -> int:
+        if filters is None:
+            return len(self._positions)
+        return int(np.count_nonzero(self.mask(filters)))
+
+    @reading
+    def aggregate(self, field: str, function: AggregateFunctions | str, filters: Filter | None = None) -> Any:
+        function = AggregateFunctions(function)
+        column = self._columns.get(field)
+        if not isinstance(column, _NumericColumn):
+            return super().aggregate(field, function, filters)
+
+        # Numeric columns are aggregated by NumPy, null values are skipped
+        selected = self._alive[:self._size] if filters is None else self.mask(filters)
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.rows_scanned += self._size
+        values = column.data[:self._size][selected & ~column.nulls[:self._size]]
+        if function == AggregateFunctions.COUNT:
+            return len(values)
+        if not len(values):
+            return 0 if function == AggregateFunctions.SUM else None
+        if function == AggregateFunctions.SUM:
+            return values.sum().item()
+        if function == AggregateFunctions.MIN:
+            return values.min().item()
+        if function == AggregateFunctions.MAX:
+            return values.max().item()
+        return float(values.mean())
+
+    @reading
+    def mask(self, filters: Filter):
+        """Boolean array over the row positions that match the filter"""
+
+        masks = [self._condition_mask(condition) for condition in filters.conditions]
+        if filters.combination == FilterCombination.AND:
+            result = self._alive[:self._size].copy()
+            for mask in masks:
+                result &= mask
+        elif filters.combination == FilterCombination.OR:
+            result = np.zeros(self._size, dtype=bool)
+            for mask in masks:
+                result |= mask
+            result &= self._alive[:self._size]
+        else:
+            raise ValueError(f"Invalid filter combination {filters.combination}")
+        return result
+
+    @writing
+    def clear(self) -> bool:
+        for field in self.fields.values():
+            field.clear()
+        self._size = 0
+        self._alive[:] = False
+        self._positions = {}
+        for column in self._columns.values():
+            if isinstance(column, _DictionaryColumn):
+                column.dictionary, column.codes = [], {}
+        self._changed()
+        return True
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def _condition_mask(self, condition: FilterCondition):
+        column = self._columns.get(condition.key)
+        if column is None:
+            return np.zeros(self._size, dtype=bool)
+        if condition.matches_every(column.field.default):
+            return np.ones(self._size, dtype=bool)
+        return column.mask(condition, self._size)
+
+    def _iter_matches(self, filters: Filter | None) -> Iterator[Entity]:
+        if filters is None:
+            yield from self.iter_all()
+            return
+        with self.read_lock():
+            entity_ids = self._ids[np.flatnonzero(self.mask(filters))].tolist()
+        yield from self._iter_ids(entity_ids)
+
+    def _iter_ids(self, entity_ids: list[int | str]) -> Iterator[Entity]:
+        # Positions move when the arrays are compacted, every row is looked up again under the lock
+        for entity_id in entity_ids:
+            with self.read_lock():
+                position = self._positions.get(entity_id)
+                entity = self._build_entity(position) if position is not None else None
+            if entity is not None:
+                yield entity
+
+    def _iter_values(self, names: list[str], filters: Filter | None) -> Iterator[tuple]:
+        with self.read_lock():
+            selected = self._alive[:self._size] if filters is None else self.mask(filters)
+            metrics = current_metrics()
+            if metrics is not None:
+                metrics.rows_scanned += self._size
+            getters = [self._ids.__getitem__ if name == 'id' else self._columns[name].get for name in names]
+            rows = [tuple([get(position) for get in getters]) for position in np.flatnonzero(selected).tolist()]
+        yield from rows
+
+    @reading
+    def _values_by_id(self, entity_id: int | str, names: list[str]) -> tuple | None:
+        position = self._positions.get(entity_id)
+        if position is None:
+            return None
+        return tuple(self._ids[position] if name == 'id' else self._columns[name].get(position) for name in names)
+
+    def _get_ids(self) -> Container[int | str]:
+        return self._positions.keys()
+
+    @reading
+    def _get_by_ids(self, entity_ids: list[int | str]) -> list[Entity]:
+        return [self._build_entity(self._positions[entity_id]) for entity_id in entity_ids
+                if entity_id in self._positions]
+
+    def _validate(self, entity: Entity):
+        super()._validate(entity)
+        # Checked before the field indexes and the arrays change, a failing value leaves no partial row
+        for name, column in self._columns.items():
+            if entity.has_field(name):
+                column.check(entity.get_field_value(name))
+
+    def _write_batch(self, inserts: list[Entity], updates: list[Entity], deletes: list[int | str]):
+        for entity_id in deletes:
+            self._alive[self._positions.pop(entity_id)] = False
+        for entity in updates:
+            self._set_row(self._positions[entity.id], entity)
+        if self._size + len(inserts) > self._capacity:
+            self._compact()
+            if self._size + len(inserts) > self._capacity:
+                self._grow(max(self._capacity * 2, self._size + len(inserts)))
+        for entity in inserts:
+            position = self._size
+            self._size += 1
+            self._ids[position] = entity.id
+            self._alive[position] = True
+            self._positions[entity.id] = position
+            self._set_row(position, entity)
+
+    def _set_row(self, position: int, entity: Entity):
+        for name, column in self._columns.items():
+            column.set(position, entity.get_field_value(name) if entity.has_field(name) else None)
+
+    def _build_entity(self, position: int) -> Entity:
+        values = [column.get(position) for column in self._columns.values()]
+        return Entity.from_values(self.schema, values, self._ids[position])
+
+    def _build_entities(self, positions) -> list[Entity]:
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.entities_decoded += len(positions)
+        return [self._build_entity(position) for position in positions.tolist()]
+
+    def _grow(self, capacity: int):
+        ids = np.empty(capacity, dtype=object)
+        ids[:self._size] = self._ids[:self._size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        self._ids, self._alive, self._capacity = ids, alive, capacity
+        for column in self._columns.values():
+            column.grow(capacity)
+
+    def _compact(self):
+        """Drop the deleted rows so their slots can be reused"""
+
+        positions = np.flatnonzero(self._alive[:self._size])
+        if len(positions) == self._size:
+            return
+        for column in self._columns.values():
+            column.compact(positions)
+        self._ids[:len(positions)] = self._ids[positions]
+        self._size = len(positions)
+        self._alive[:] = False
+        self._alive[:self._size] = True
+        self._positions = {entity_id: position for position, entity_id in enumerate(self._ids[:self._size])}
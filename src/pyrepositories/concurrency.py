@@ -0,0 +1,178 @@
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator
+from threading import Condition, Lock, get_ident
+import gc
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows has no advisory file locks
+    fcntl = None
+
+
+class ReadWriteLock:
+    """Many readers or a single writer, reentrant per thread
+
+    A waiting writer blocks new readers so a steady stream of reads can not starve it.
+    A thread holding the write lock may also read, upgrading a read lock to a write lock is not supported.
+    """
+
+    def __init__(self):
+        self._condition = Condition(Lock())
+        self._readers = {}  # type: dict[int, int]
+        self._writer = None  # type: int | None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        me = get_ident()
+        with self._condition:
+            if self._writer == me or me in self._readers:
+                self._readers[me] = self._readers.get(me, 0) + 1
+                return
+            while self._writer is not None or self._waiting_writers:
+                self._condition.wait()
+            self._readers[me] = 1
+
+    def release_read(self):
+        me = get_ident()
+        with self._condition:
+            depth = self._readers[me] - 1
+            if depth:
+                self._readers[me] = depth
+                return
+            del self._readers[me]
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        me = get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            if me in self._readers:
+                raise RuntimeError("Can not upgrade a read lock to a write lock")
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        with self._condition:
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._condition.notify_all()
+
+    def is_held(self) -> bool:
+        """Whether the calling thread holds the lock for reading or writing"""
+
+        me = get_ident()
+        return self._writer == me or me in self._readers
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class FileLock:
+    """Advisory lock shared by every process that opens the same lock file, a no-op where fcntl is missing
+
+    The lock is not reentrant, callers take it once per outermost operation.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def shared(self):
+        return self._locked(fcntl.LOCK_SH if fcntl else 0)
+
+    def exclusive(self):
+        return self._locked(fcntl.LOCK_EX if fcntl else 0)
+
+    @contextmanager
+    def _locked(self, operation: int) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        with open(self.path, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_write(path: str, data: str | bytes):
+    """Replace the file with a renamed temporary file, readers see either the old or the new content"""
+
+    directory, name = os.path.split(os.path.abspath(path))
+    descriptor, temp_path = tempfile.mkstemp(prefix=f'.{name}.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(descriptor, 'wb' if isinstance(data, bytes) else 'w') as temp_file:
+            temp_file.write(data)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        if os.path.exists(path):
+            # mkstemp creates the file readable by the owner only
+            os.chmod(temp_path, os.stat(path).st_mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+@contextmanager
+def paused_gc() -> Iterator[None]:
+    """Disable the cyclic garbage collector for a block that allocates many objects that stay alive
+
+    The collector is enabled again afterwards only when it was enabled before, so blocks can be nested.
+    """
+
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def reading(method: Callable) -> Callable:
+    """Run the method while holding the read lock of its table"""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.read_lock():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def writing(method: Callable) -> Callable:
+    """Run the method while holding the write lock of its table"""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.write_lock():
+            return method(self, *args, **kwargs)
+    return wrapper
@@ -1,128 +1,215 @@
 from .datatable import DataTable
 from .lib import Entity, IdTypes, Filter
-import random
-import string
-from uuid import uuid4 as get_uuid
+from .transaction import Transaction
+from .ids import random_string_ids, uuid_ids
+from .metrics import Observer
+from .scan import ParallelScanner
+from .aggregate import AggregateFunctions
+from typing import Any, Iterator
+import threading
 
 
-def get_random_string_id():
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=16))
+def get_ids(id_type: IdTypes, count: int) -> list[str]:
+    """Generated string ids, integer ids come from the sequence of the table"""
 
-
-def get_sequential_id(data):
-    return len(data) + 1
-
-
-def get_id(id_type: IdTypes, data: list[Entity]):
-    if id_type == IdTypes.INT:
-        return get_sequential_id(data)
-    elif id_type == IdTypes.STR:
-        return get_random_string_id()
+    if id_type == IdTypes.STR:
+        return random_string_ids(count)
     elif id_type == IdTypes.UUID:
-        return str(get_uuid())
+        return uuid_ids(count)
     else:
         raise ValueError("Invalid id_type")
 
 
 class DataSource:
-    def __init__(self, auto_increment=True, id_type: IdTypes = IdTypes.INT):
+    def __init__(self, auto_increment=True, id_type: IdTypes = IdTypes.INT, observer: Observer | None = None,
+                 scanner: ParallelScanner | None = None):
         if id_type not in IdTypes:
             raise ValueError("Invalid id_type")
 
         self.id_type = id_type
-        self.tables = [] #type: list[DataTable]
+        self.observer = observer
+        self.scanner = scanner
+        self.tables = {}  # type: dict[str, DataTable]
         self.auto_increment = auto_increment
+        self._lock = threading.Lock()
 
     def add_table(self, table: DataTable):
-        if table not in self.tables:
-            self.tables.append(table)
+        with self._lock:
+            # The first table registered under a name is kept, like get_table used to return the first match
+            if self.tables.setdefault(table.get_name(), table) is not table:
+                return
+            if self.observer is not None:
+                table.observer = self.observer
+            if self.scanner is not None:
+                table.scanner = self.scanner
 
     def drop(self, table_name: str):
-        for table in self.tables:
-            if table.get_name() == table_name:
-                self.tables.remove(table)
-                return True
-
-        return False
+        with self._lock:
+            return self.tables.pop(table_name, None) is not None
 
     def get_table(self, name: str) -> DataTable | None:
-        for table in self.tables:
-            if table.get_name() == name:
-                return table
+        return self.tables.get(name)
 
-        return None
-
-    def get_all(self, table_name: str):
+    def get_all(self, table_name: str, fields: list[str] | None = None):
         table = self.get_table(table_name)
-        if table:
-            return table.get_all()
+        if table is not None:
+            return table.get_all(fields=fields)
         else:
             raise ValueError("Table not found")
 
-    def get_by_id(self, table_name: str, id: int | str):
+    def get_by_id(self, table_name: str, id: int | str, fields: list[str] | None = None):
         table = self.get_table(table_name)
-        if table:
-            return table.get_by_id(id)
+        if table is not None:
+            return table.get_by_id(id, fields=fields)
         else:
             return None
 
-    def get_by_filter(self, table_name: str, filter: Filter):
+    def get_by_filter(self, table_name: str, filter: Filter, fields: list[str] | None = None):
         table = self.get_table(table_name)
-        if table:
-            return table.get_by_filter(filter)
+        if table is not None:
+            return table.get_by_filter(filter, fields=fields)
         else:
             raise ValueError("Table not found")
 
     def get_by_filters(self, table_name: str, filters: list[Filter]):
+        """Entities matching any of the filters, each entity is returned once"""
+
+        table = self.get_table(table_name)
+        if table is not None:
+            return table.get_by_filters(filters)
+        else:
+            raise ValueError("Table not found")
+
+    def count(self, table_name: str, filter: Filter | None = None) -> int:
+        table = self.get_table(table_name)
+        if table is not None:
+            return table.count(filter)
+        else:
+            raise ValueError("Table not found")
+
+    def aggregate(self, table_name: str, field: str, function: AggregateFunctions | str, filter: Filter | None = None):
+        table = self.get_table(table_name)
+        if table is not None:
+            return table.aggregate(field, function, filter)
+        else:
+            raise ValueError("Table not found")
+
+    def group_by(self, table_name: str, field: str, aggregates: dict[str, tuple[str, AggregateFunctions | str]] | None = None,
+                 filter: Filter | None = None):
+        table = self.get_table(table_name)
+        if table is not None:
+            return table.group_by(field, aggregates, filter)
+        else:
+            raise ValueError("Table not found")
+
+    def iter_all(self, table_name: str) -> Iterator[Entity]:
+        table = self.get_table(table_name)
+        if table is not None:
+            return table.iter_all()
+        else:
+            raise ValueError("Table not found")
+
+    def iter_by_filter(self, table_name: str, filter: Filter | None = None, limit: int | None = None, offset: int = 0,
+                       order_by: str | None = None, descending: bool = False) -> Iterator[Entity]:
         table = self.get_table(table_name)
-        if table:
-            entities = []
-            for filter in filters:
-                entities.extend(table.get_by_filter(filter))
-            return entities
+        if table is not None:
+            return table.iter_by_filter(filter, limit=limit, offset=offset, order_by=order_by, descending=descending)
         else:
             raise ValueError("Table not found")
 
     def get_unique(self, table_name: str, field_name: str, value: any):
         table = self.get_table(table_name)
-        if table:
+        if table is not None:
             return table.get_unique(field_name, value)
         else:
             return None
 
     def insert(self, table_name: str, data: Entity):
         table = self.get_table(table_name)
-        if not table:
+        if table is None:
             raise ValueError("Table not found")
 
-        if self.auto_increment:
-            data.id = get_id(self.id_type, table.get_all())
-        else:
-            if not data.id:
-                raise ValueError("Entity must have an id")
-            if table.get_by_id(data.id):
-                return False
-        return table.insert(data)
+        # Generating the id and inserting must not interleave with other writers
+        with table.write_lock():
+            if self.auto_increment:
+                data.id = self._generate_ids(table, 1)[0]
+            else:
+                if not data.id:
+                    raise ValueError("Entity must have an id")
+                if table.get_by_id(data.id):
+                    return False
+            return table.insert(data)
+
+    def insert_many(self, table_name: str, data: list[Entity]):
+        table = self.get_table(table_name)
+        if table is None:
+            raise ValueError("Table not found")
+
+        with table.write_lock():
+            if self.auto_increment:
+                for entity, entity_id in zip(data, self._generate_ids(table, len(data))):
+                    entity.id = entity_id
+            return table.insert_many(data)
 
     def update(self, table_name, id: int | str, data: Entity):
         table = self.get_table(table_name)
-        if table:
-            if not table.get_by_id(id):
-                return False
-            return table.update(id, data)
+        if table is not None:
+            with table.write_lock():
+                if not table.get_by_id(id):
+                    return False
+                return table.update(id, data)
         else:
             return None
 
+    def update_many(self, table_name, data: list[Entity]):
+        table = self.get_table(table_name)
+        if table is not None:
+            return table.update_many(data)
+        else:
+            return None
+
+    def update_where(self, table_name: str, filter: Filter, changes: dict[str, Any]) -> int:
+        table = self.get_table(table_name)
+        if table is not None:
+            return table.update_where(filter, changes)
+        else:
+            raise ValueError("Table not found")
+
     def delete(self, table_name, id):
         table = self.get_table(table_name)
-        if table:
+        if table is not None:
             return table.delete(id)
         else:
             return None
 
+    def delete_many(self, table_name, ids: list[int | str]):
+        table = self.get_table(table_name)
+        if table is not None:
+            return table.delete_many(ids)
+        else:
+            return None
+
+    def delete_where(self, table_name: str, filter: Filter) -> int:
+        table = self.get_table(table_name)
+        if table is not None:
+            return table.delete_where(filter)
+        else:
+            raise ValueError("Table not found")
+
+    def transaction(self, table_name: str) -> Transaction:
+        table = self.get_table(table_name)
+        if table is None:
+            raise ValueError("Table not found")
+        return table.transaction()
+
     def clear(self, table_name):
         table = self.get_table(table_name)
-        if table:
+        if table is not None:
             return table.clear()
         else:
             return None
+
+    def _generate_ids(self, table: DataTable, count: int) -> list[int | str]:
+        if self.id_type == IdTypes.INT:
+            return list(table.id_sequence().reserve(count))
+        return get_ids(self.id_type, count)
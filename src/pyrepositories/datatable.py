@@ -1,11 +1,115 @@
-from .lib import Entity, filter_by_fields, FieldKeyTypes, FieldBase, TableField, IdTypes, Filter, FieldValue
-from typing import Any
+from .lib import Entity, filter_by_fields, FieldKeyTypes, FieldBase, TableField, IdTypes, Filter, FieldValue, Schema
+from .lib import EntityField, FieldTypes, FilterCombination, FilterCondition, RowDecoder
+from .transaction import Transaction
+from .concurrency import ReadWriteLock, reading, writing
+from .ids import IdSequence
+from .metrics import NULL_OBSERVER, Observer, current_metrics, instrumented
+from .cache import LRUCache
+from .scan import ParallelScanner
+from .aggregate import AggregateFunctions, aggregate_values, group_values, normalize_aggregates
+from typing import Any, Callable, Container, Iterable, Iterator
+from functools import wraps
+from itertools import islice
+import heapq
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Public operations reported to the observer, overrides in subclasses are wrapped automatically
+_INSTRUMENTED = ('get_all', 'get_by_id', 'get_unique', 'get_by_filter', 'get_by_filters', 'count', 'aggregate',
+                 'group_by', 'insert', 'insert_many', 'update', 'update_many', 'update_where', 'delete', 'delete_many',
+                 'delete_where', 'clear')
+# Field types SUM and AVG accept
+_NUMERIC_TYPES = (FieldTypes.INT, FieldTypes.FLOAT, FieldTypes.BOOL)
+# Queries accepting fields=[...], mapped to the method building the projected rows
+_PROJECTED = {'get_all': '_project_all', 'get_by_id': '_project_by_id', 'get_by_filter': '_project_by_filter'}
+
+
+def _sorted_ids(entity_ids: Iterable[int | str]) -> list[int | str]:
+    try:
+        return sorted(entity_ids)
+    except TypeError:
+        return list(entity_ids)
+
+
+def _is_int_id(entity_id: int | str) -> bool:
+    return isinstance(entity_id, int) and not isinstance(entity_id, bool)
+
+
+def _query_key(filters: Filter | list[Filter]) -> tuple:
+    if isinstance(filters, Filter):
+        return filters.key_tuple()
+    return tuple(filter.key_tuple() for filter in filters)
+
+
+def projected(method: Callable) -> Callable:
+    """Let a query return dicts holding only the requested fields when it is called with fields=[...]
+
+    The values are read by the _iter_values and _values_by_id hooks, the built-in backends read them from the
+    stored rows without building entities. Subclasses overriding get_all, get_by_id or get_by_filter apply it
+    to accept fields.
+    """
+
+    project = _PROJECTED[method.__name__]
+
+    @wraps(method)
+    def wrapper(self, *args, fields: list[str] | None = None, **kwargs):
+        if fields is None:
+            return method(self, *args, **kwargs)
+        return getattr(self, project)(list(fields), *args, **kwargs)
+
+    return wrapper
+
+
+def cached_query(method: Callable) -> Callable:
+    """Serve repeated queries from the query cache of the table until the table is written to
+
+    Results are keyed by the table version, so a write makes every cached result unreachable.
+    Queries on filter values that can not be hashed, or called with further arguments, are not cached.
+    Subclasses overriding get_by_filter or get_by_filters apply it to keep their queries cached.
+    """
+
+    @wraps(method)
+    def wrapper(self, filters, *args, **kwargs):
+        cache = self.query_cache
+        if cache is None or args or kwargs:
+            return method(self, filters, *args, **kwargs)
+        with self.read_lock():
+            try:
+                key = (self._version, method.__name__, _query_key(filters))
+            except TypeError:
+                return method(self, filters)
+            result = cache.get(key)
+            if result is None:
+                result = method(self, filters)
+                cache.put(key, result)
+            return list(result)
+
+    return wrapper
+
 
 class DataTable:
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for operation in _INSTRUMENTED:
+            method = cls.__dict__.get(operation)
+            if method is not None and not getattr(method, 'instrumented', False):
+                setattr(cls, operation, instrumented(operation)(method))
+
     def __init__(self, name, field_structure: list[FieldBase]):
         self.name = name
         self.field_structure = field_structure
         self.fields = {}  # type: dict[str, TableField]
+        self.schema = Schema.of(field_structure)
+        self.observer = NULL_OBSERVER  # type: Observer
+        self._lock = ReadWriteLock()
+        self._local = threading.local()
+        self._id_sequence = None  # type: IdSequence | None
+        self._sequence_lock = threading.Lock()
+        self.query_cache = None  # type: LRUCache | None
+        self.scanner = None  # type: ParallelScanner | None
+        self._version = 0
 
         for field in field_structure:
             self.fields[field.name] = TableField(field)
@@ -13,73 +117,493 @@ class DataTable:
     def get_name(self) -> str:
         return self.name
 
+    @instrumented('get_all')
+    @projected
     def get_all(self) -> list[Entity]:
         """Get all entities from the data source while updating the fields"""
 
-        print("Override this method in child class")
+        logger.warning("Override %s.get_all in child class", type(self).__name__)
         return []
 
+    @instrumented('get_by_id')
+    @projected
     def get_by_id(self, entity_id: int | str) -> Entity | None:
         """Get entity by id from the data source while updating the fields"""
 
-        print("Override this method in child class")
+        logger.warning("Override %s.get_by_id in child class", type(self).__name__)
         return None
 
+    @instrumented('get_unique')
+    @reading
     def get_unique(self, key: str, value: Any) -> Entity | None:
         """Get entity by unique key from the data source"""
 
-        print("Override this method in child class")
-        return None
+        field_value = self._get_unique(key, value)
+        if not field_value:
+            return None
+        return self.get_by_id(field_value.entity_id)
 
+    @instrumented('get_by_filter')
+    @projected
+    @cached_query
+    @reading
     def get_by_filter(self, filters: Filter) -> list[Entity]:
-        print(f'Filter: {filters}')
-        entities = self.get_all()
+        logger.debug("Filter: %s", filters)
+        candidates = self._get_candidate_ids(filters)
+        if candidates is None:
+            matches = self._parallel_matches([filters])
+            if matches is not None:
+                return matches
+            entities = self.get_all()
+        else:
+            entities = self._get_by_ids(candidates)
         return filter_by_fields(entities, filters)
 
+    @instrumented('get_by_filters')
+    @cached_query
+    @reading
+    def get_by_filters(self, filters: list[Filter]) -> list[Entity]:
+        """Entities matching any of the filters in a single pass, each entity is returned once"""
+
+        return list(self._iter_matches_any(filters))
+
+    @instrumented('count')
+    @reading
+    def count(self, filters: Filter | None = None) -> int:
+        """Number of entities matching the filter, of every entity without one"""
+
+        if filters is None:
+            return len(self._get_ids())
+        return sum(1 for _ in self._iter_matches(filters))
+
+    @instrumented('aggregate')
+    @reading
+    def aggregate(self, field: str, function: AggregateFunctions | str, filters: Filter | None = None) -> Any:
+        """Aggregate a field ('id' for the ids) over the matching entities, None values are skipped like in SQL"""
+
+        function = AggregateFunctions(function)
+        self._check_aggregates([(field, function)])
+        return aggregate_values((values[0] for values in self._iter_values([field], filters)), function)
+
+    @instrumented('group_by')
+    @reading
+    def group_by(self, field: str, aggregates: dict[str, tuple[str, AggregateFunctions | str]] | None = None,
+                 filters: Filter | None = None) -> dict[Any, dict[str, Any]]:
+        """Aggregates per distinct value of field, e.g. group_by('status', {'total': ('amount', 'sum')})
+
+        aggregates maps result names to (field, function), by default the entities of each group are counted.
+        """
+
+        aggregates = normalize_aggregates(aggregates)
+        columns = [field] + [column for _, column, _ in aggregates]
+        self._check_columns([field])
+        self._check_aggregates([(column, function) for _, column, function in aggregates])
+        return group_values(self._iter_values(columns, filters), [(name, function) for name, _, function in aggregates])
+
+    def iter_all(self) -> Iterator[Entity]:
+        """Yield the entities one at a time, backends override this to decode rows lazily"""
+
+        yield from self.get_all()
+
+    def iter_by_filter(self, filters: Filter | None = None, limit: int | None = None, offset: int = 0,
+                       order_by: str | None = None, descending: bool = False) -> Iterator[Entity]:
+        """Yield the matching entities, stopping once limit entities were produced
+
+        With order_by only the first offset + limit entities are kept in a heap instead of sorting every match.
+        """
+
+        matches = self._iter_matches(filters)
+        if order_by is None:
+            stop = None if limit is None else offset + limit
+            yield from islice(matches, offset, stop)
+            return
+
+        def key(entity: Entity):
+            value = entity.id if order_by == 'id' else entity.get_field_value(order_by)
+            return (value is None, value) if not descending else (value is not None, value)
+
+        if limit is None:
+            ordered = sorted(matches, key=key, reverse=descending)
+        elif descending:
+            ordered = heapq.nlargest(offset + limit, matches, key=key)
+        else:
+            ordered = heapq.nsmallest(offset + limit, matches, key=key)
+        yield from islice(ordered, offset, None)
+
+    @instrumented('insert')
     def insert(self, data: Entity) -> Entity | None:
-        return self._insert(data, self.get_all())
+        result = self.insert_many([data])
+        return result[0] if result else None
 
+    @instrumented('insert_many')
     def insert_many(self, data: list[Entity]) -> list[Entity] | None:
-        entities = self.get_all()
-        for entity in data:
-            self._insert(entity, entities)
-        return data
+        if self._transaction is not None:
+            return [self._transaction.insert(entity) for entity in data]
+        inserted, _, _ = self._apply_batch(data, [], [])
+        return inserted
 
+    @instrumented('update')
     def update(self, entity_id, data: Entity) -> Entity | None:
-        print("Override this method in child class")
-        return None
+        data.id = entity_id
+        result = self.update_many([data])
+        return result[0] if result else None
+
+    @instrumented('update_many')
+    def update_many(self, data: list[Entity]) -> list[Entity] | None:
+        """Update the given entities by their id, entities with unknown ids are skipped"""
 
+        if self._transaction is not None:
+            return [self._transaction.update(entity.id, entity) for entity in data]
+        _, updated, _ = self._apply_batch([], data, [])
+        return updated
+
+    @instrumented('delete')
     def delete(self, entity_id: IdTypes) -> bool:
-        print("Override this method in child class")
-        return False
+        return self.delete_many([entity_id]) == 1
+
+    @instrumented('delete_many')
+    def delete_many(self, entity_ids: list[int | str]) -> int:
+        """Delete the given ids and return the number of deleted entities"""
+
+        if self._transaction is not None:
+            return self._transaction.delete_many(entity_ids)
+        _, _, deleted = self._apply_batch([], [], entity_ids)
+        return len(deleted)
+
+    @instrumented('update_where')
+    @writing
+    def update_where(self, filters: Filter, changes: dict[str, Any]) -> int:
+        """Set the given field values on every matching entity with a single write, returns the number updated"""
+
+        if 'id' in changes:
+            raise ValueError("The id of an entity can not be changed")
+        self._check_columns(list(changes))
+        updates = [self._with_changes(entity, changes) for entity in self._iter_matches(filters)]
+        if not updates:
+            return 0
+        return len(self.update_many(updates))
+
+    @instrumented('delete_where')
+    @writing
+    def delete_where(self, filters: Filter) -> int:
+        """Delete every matching entity with a single write and return the number of deleted entities"""
 
+        entity_ids = [values[0] for values in self._iter_values(['id'], filters)]
+        if not entity_ids:
+            return 0
+        return self.delete_many(entity_ids)
+
+    @instrumented('clear')
     def clear(self) -> bool:
-        print("Override this method in child class")
+        logger.warning("Override %s.clear in child class", type(self).__name__)
         return False
 
-    def _insert(self, data: Entity, content: list[Entity]) -> Entity | None:
-        content_dict = {}
-        for item in content:
-            content_dict[item.id] = item
+    def transaction(self) -> Transaction:
+        """Buffer the mutations made inside a with block and write them at once when it exits"""
+
+        return Transaction(self)
+
+    def get_transaction(self) -> Transaction | None:
+        return self._transaction
+
+    def id_sequence(self) -> IdSequence:
+        """The sequence the integer ids of auto incremented inserts are taken from
+
+        Reserve ids while holding write_lock(), the sequence is seeded from the stored ids on first use.
+        """
+
+        with self._sequence_lock:
+            if self._id_sequence is None:
+                self._id_sequence = self._create_id_sequence()
+            return self._id_sequence
+
+    def enable_query_cache(self, max_size: int = 128):
+        """Cache the results of get_by_filter and get_by_filters until the table is written to
+
+        The cache keeps the max_size most recently used results, its hits and misses are counted in
+        query_cache.hits and query_cache.misses. Cached entities are shared between callers, use update()
+        to change them. JsonTable also sees the writes of other processes, other backends only the
+        writes made through the table.
+        """
+
+        self.query_cache = LRUCache(max_size)
+
+    def disable_query_cache(self):
+        self.query_cache = None
+
+    def read_lock(self):
+        """Held while reading, readers of a table run in parallel"""
+
+        return self._lock.read()
+
+    def write_lock(self):
+        """Held while writing, excludes every other reader and writer of the table"""
+
+        return self._lock.write()
+
+    @property
+    def _transaction(self) -> Transaction | None:
+        # Transactions belong to the thread that opened them
+        return getattr(self._local, 'transaction', None)
+
+    @_transaction.setter
+    def _transaction(self, transaction: Transaction | None):
+        self._local.transaction = transaction
+
+    def _changed(self):
+        """Make the cached query results stale, called with the write lock held whenever the rows change"""
+
+        self._version += 1
+
+    def _get_ids(self) -> Container[int | str]:
+        return {entity.id for entity in self.get_all() if entity}
+
+    def _create_id_sequence(self) -> IdSequence:
+        return IdSequence(self._max_id)
+
+    def _max_id(self) -> int:
+        """The largest integer id stored in the table, 0 when there is none"""
+
+        return max((entity_id for entity_id in self._get_ids() if _is_int_id(entity_id)), default=0)
+
+    def _write_batch(self, inserts: list[Entity], updates: list[Entity], deletes: list[int | str]):
+        """Persist an already validated batch, called once per batch"""
+
+        logger.warning("Override %s._write_batch in child class", type(self).__name__)
+
+    def _find_existing(self, entity_ids: list[int | str]) -> set[int | str]:
+        """The subset of the given ids that are stored in the table"""
+
+        existing = self._get_ids()
+        return {entity_id for entity_id in entity_ids if entity_id in existing}
+
+    @writing
+    def _apply_batch(self, inserts: list[Entity], updates: list[Entity],
+                     deletes: list[int | str]) -> tuple[list[Entity], list[Entity], list[int | str]]:
+        existing = self._find_existing([entity.id for entity in inserts + updates] + list(deletes))
+        inserted_ids = set()
+        for entity in inserts:
+            if not entity.id:
+                raise ValueError("Entity must have an id")
+            if entity.id in existing or entity.id in inserted_ids:
+                raise ValueError("Entity already exists")
+            inserted_ids.add(entity.id)
+        updates = [entity for entity in updates if entity.id in existing]
+        deletes = [entity_id for entity_id in dict.fromkeys(deletes) if entity_id in existing]
+
+        for entity in inserts + updates:
+            self._validate(entity)
+        self._check_unique(inserts + updates, deletes)
+        self._index_batch(inserts, updates, deletes)
+
+        if inserts or updates or deletes:
+            self._write_batch(inserts, updates, deletes)
+            self._changed()
+        inserted = [entity.id for entity in inserts if _is_int_id(entity.id)]
+        if inserted:
+            # Persisted sequences are advanced even when this table never reserved an id
+            self.id_sequence().advance(max(inserted))
+        return inserts, updates, deletes
+
+    def _index_batch(self, inserts: list[Entity], updates: list[Entity], deletes: list[int | str]):
+        # Release the old values first so entities can swap unique values within a batch
+        for field in self.fields.values():
+            for entity_id in deletes:
+                field.remove_value(entity_id)
+            for entity in updates:
+                field.remove_value(entity.id)
+        for entity in inserts + updates:
+            for name, value in entity.get_field_items():
+                self.fields[name].set_value(entity.id, value)
+
+    def _validate(self, entity: Entity):
+        """Rows are only validated on write, the read paths trust the stored data"""
+
+        if not entity.validate():
+            raise ValueError(str(entity.errors[-1]))
+        for field in self.fields.values():
+            if field.key_type < FieldKeyTypes.STANDARD and not entity.has_field(field.name):
+                raise ValueError(f"Field {field.name} is required")
+
+    def _check_unique(self, entities: list[Entity], deletes: list[int | str]):
+        changed = {entity.id for entity in entities}
+        changed.update(deletes)
+        for field in self.fields.values():
+            if not field.is_unique():
+                continue
+            claimed = {}
+            for entity in entities:
+                value = entity.get_field_value(field.name) if entity.has_field(field.name) else None
+                if value is None:
+                    continue
+                owner = self._owner_of(field, value)
+                if (owner is not None and owner not in changed) or value in claimed:
+                    raise ValueError(f"Value {value} already exists in field {field.name}")
+                claimed[value] = entity.id
+
+    def _owner_of(self, field: TableField, value: Any) -> int | str | None:
+        """Id of the stored entity holding the value of a unique field"""
+
+        return field.find(value)
+
+    @reading
+    def _get_candidate_ids(self, filters: Filter) -> list[int | str] | None:
+        """Ids that can match the filter according to the field indexes, None when every entity has to be scanned
+
+        Picks the indexed condition of an AND filter that matches the fewest entities, the remaining
+        conditions are checked on the candidates by the caller.
+        """
+
+        if filters.combination != FilterCombination.AND and len(filters.conditions) != 1:
+            return None
+        best = None  # type: tuple[int, TableField, FilterCondition] | None
+        for condition in filters.conditions:
+            field = self.fields.get(condition.key)
+            if field is None or condition.matches_every(field.default):
+                continue
+            try:
+                estimate = field.estimate(condition.filter_type, condition.value)
+            except TypeError:
+                continue
+            if estimate is not None and (best is None or estimate < best[0]):
+                best = (estimate, field, condition)
+        if best is None:
+            return None
+
+        _, field, condition = best
+        return _sorted_ids(dict.fromkeys(field.lookup(condition.filter_type, condition.value)))
+
+    def _get_by_ids(self, entity_ids: list[int | str]) -> list[Entity]:
+        return [entity for entity in map(self.get_by_id, entity_ids) if entity]
+
+    def _iter_matches(self, filters: Filter | None) -> Iterator[Entity]:
+        if filters is None:
+            yield from self.iter_all()
+            return
+        predicate = filters.compile()
+        candidates = self._get_candidate_ids(filters)
+        entities = self.iter_all() if candidates is None else self._get_by_ids(candidates)
+        for entity in entities:
+            if predicate(entity):
+                yield entity
+
+    def _iter_matches_any(self, filters: list[Filter]) -> Iterator[Entity]:
+        if not filters:
+            return
+        predicates = [filter.compile() for filter in filters]
+        candidates = set()
+        for filter in filters:
+            entity_ids = self._get_candidate_ids(filter)
+            if entity_ids is None:
+                candidates = None
+                break
+            candidates.update(entity_ids)
+        if candidates is None:
+            matches = self._parallel_matches(filters)
+            if matches is not None:
+                yield from matches
+                return
+        entities = self.iter_all() if candidates is None else self._get_by_ids(_sorted_ids(candidates))
+        for entity in entities:
+            if any(predicate(entity) for predicate in predicates):
+                yield entity
+
+    def _iter_values(self, names: list[str], filters: Filter | None) -> Iterator[tuple]:
+        """The values of the given fields of every matching entity, backends read them without building entities"""
+
+        for entity in self._iter_matches(filters):
+            yield tuple(entity.id if name == 'id' else entity.get_field_value(name) for name in names)
+
+    def _values_by_id(self, entity_id: int | str, names: list[str]) -> tuple | None:
+        """The values of the given fields of one entity, None when it does not exist"""
+
+        entity = self.get_by_id(entity_id)
+        if entity is None:
+            return None
+        return tuple(entity.id if name == 'id' else entity.get_field_value(name) for name in names)
+
+    @reading
+    def _project_all(self, fields: list[str]) -> list[dict[str, Any]]:
+        self._check_columns(fields)
+        return [dict(zip(fields, values)) for values in self._iter_values(fields, None)]
+
+    @reading
+    def _project_by_id(self, fields: list[str], entity_id: int | str) -> dict[str, Any] | None:
+        self._check_columns(fields)
+        values = self._values_by_id(entity_id, fields)
+        return None if values is None else dict(zip(fields, values))
+
+    @reading
+    def _project_by_filter(self, fields: list[str], filters: Filter) -> list[dict[str, Any]]:
+        self._check_columns(fields)
+        return [dict(zip(fields, values)) for values in self._iter_values(fields, filters)]
+
+    def _with_changes(self, entity: Entity, changes: dict[str, Any]) -> Entity:
+        # A copy, the matched entity may be shared with an entity cache
+        entity = entity.copy()
+        for name, value in changes.items():
+            if entity.has_field(name):
+                entity.set_field_value(name, value)
+            else:
+                entity.add_field(name, EntityField(self.schema.fields[self.schema.positions[name]], value))
+        return entity
+
+    def _check_aggregates(self, aggregates: list[tuple[str, AggregateFunctions]]):
+        # SUM and AVG only add numbers, other values would sum differently in Python and in SQL
+        for name, function in aggregates:
+            self._check_columns([name])
+            if function in (AggregateFunctions.SUM, AggregateFunctions.AVG) and \
+                    (name == 'id' or self.fields[name].field_type not in _NUMERIC_TYPES):
+                raise ValueError(f"{function.name} needs a numeric field, {name} is not")
+
+    def _check_columns(self, names: list[str]):
+        for name in names:
+            if name != 'id' and name not in self.fields:
+                raise ValueError(f"Field {name} does not exist in table {self.name}")
+
+    def _raw_rows(self) -> list[dict] | None:
+        """The stored rows as dicts keyed by field name for parallel scans, None when the backend does not keep them"""
+
+        return None
+
+    def _decode_row(self, row: dict) -> Entity:
+        """The entity of a row returned by _raw_rows, backends with their own RowDecoder should use it"""
+
+        return RowDecoder(self.schema).decode(row)
+
+    def _parallel_matches(self, filters: list[Filter]) -> list[Entity] | None:
+        """Entities matching any of the filters found by the scanner, None when the scan has to run serially"""
 
-        if not data.id:
-            raise ValueError("Entity must have an id")
-        if data.id in content_dict:
-            raise ValueError("Entity already exists")
-        for field in data.get_fields():
-            self.fields[field.name].set_value(data.id, field.value)
-        return data
+        if self.scanner is None:
+            return None
+        rows = self._raw_rows()
+        if rows is None:
+            return None
+        positions = self.scanner.match(self.field_structure, rows, filters)
+        if positions is None:
+            return None
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.rows_scanned += len(rows)
+            metrics.entities_decoded += len(rows)
+        return [self._decode_row(rows[position]) for position in positions]
 
     def _get_unique(self, field_name: str, value: Any) -> FieldValue | None:
-        for field in [field for field in self.fields.values() if field.key_type == FieldKeyTypes.UNIQUE]:
-            if field.name == field_name:
-               return field.get_unique(value)
-        print(f"No record found with {field_name} = {value}")
+        field = self.fields.get(field_name)
+        if field is not None and field.is_unique():
+            return field.get_unique(value)
+        logger.debug("No record found with %s = %s", field_name, value)
         return None
 
     def _refresh_fields(self):
+        for field in self.fields.values():
+            field.clear()
         entities = self.get_all()
         for entity in entities:
-            for field in entity.get_fields():
-                if entity.id is not None:
-                    self.fields[field.name].set_value(entity.id, field.value)
+            if entity is None or entity.id is None:
+                continue
+            for name, value in entity.get_field_items():
+                try:
+                    self.fields[name].set_value(entity.id, value)
+                except ValueError as error:
+                    logger.warning("Entity %s: %s", entity.id, error)
@@ -0,0 +1,106 @@
+from typing import Callable
+from uuid import UUID
+from .concurrency import FileLock, atomic_write
+import json
+import os
+import random
+import string
+import threading
+
+_ALPHABET = string.ascii_letters + string.digits
+
+
+def random_string_ids(count: int, length: int = 16) -> list[str]:
+    """Random alphanumeric ids, drawn with a single random.choices call for the whole batch"""
+
+    characters = ''.join(random.choices(_ALPHABET, k=count * length))
+    return [characters[start:start + length] for start in range(0, count * length, length)]
+
+
+def uuid_ids(count: int) -> list[str]:
+    """Version 4 UUIDs built from a single os.urandom call for the whole batch"""
+
+    data = os.urandom(16 * count)
+    return [str(UUID(bytes=data[start:start + 16], version=4)) for start in range(0, 16 * count, 16)]
+
+
+class IdSequence:
+    """Hands out increasing integer ids, ids are never reused even after the entities were deleted
+
+    The sequence starts after seed(), the largest id stored when it is first used.
+    """
+
+    def __init__(self, seed: Callable[[], int]):
+        self._seed = seed
+        self._next = None  # type: int | None
+        self._lock = threading.Lock()
+
+    def reserve(self, count: int) -> range:
+        with self._lock:
+            if self._next is None:
+                self._next = self._seed() + 1
+            start = self._next
+            self._next += count
+            return range(start, start + count)
+
+    def advance(self, entity_id: int):
+        """Make sure an id that was inserted explicitly is never handed out"""
+
+        with self._lock:
+            if self._next is not None and entity_id >= self._next:
+                self._next = entity_id + 1
+
+
+class FileIdSequence(IdSequence):
+    """IdSequence persisted in a file and shared by every process using it
+
+    Ids are reserved from the file in blocks of block_size, so a bulk insert or a run of single
+    inserts only updates the file once per block. Ids of a block that is not used up are skipped.
+    """
+
+    def __init__(self, path: str, seed: Callable[[], int], block_size: int = 100):
+        if block_size <= 0:
+            raise ValueError("block_size must be a positive integer")
+
+        super().__init__(seed)
+        self.path = path
+        self.block_size = block_size
+        self._limit = None  # type: int | None
+        self._file_lock = FileLock(f'{path}.lock')
+
+    def reserve(self, count: int) -> range:
+        with self._lock:
+            if self._next is None or self._next + count > self._limit:
+                with self._file_lock.exclusive():
+                    high = self._read()
+                    if self._limit != high:
+                        # Another process reserved ids since our last block
+                        self._next = high
+                    self._limit = max(self._next + count, high + self.block_size)
+                    self._write(self._limit)
+            start = self._next
+            self._next += count
+            return range(start, start + count)
+
+    def advance(self, entity_id: int):
+        with self._lock:
+            if self._next is not None and entity_id < self._limit:
+                self._next = max(self._next, entity_id + 1)
+                return
+            with self._file_lock.exclusive():
+                if entity_id >= self._read():
+                    self._write(entity_id + 1)
+            # Start a new block on the next reserve
+            self._next = self._limit = None
+
+    def _read(self) -> int:
+        """The first id that was not reserved by any process"""
+
+        try:
+            with open(self.path, 'r') as sequence_file:
+                return json.load(sequence_file)['next']
+        except FileNotFoundError:
+            return self._seed() + 1
+
+    def _write(self, next_id: int):
+        atomic_write(self.path, json.dumps({'next': next_id}))
@@ -0,0 +1,78 @@
+from bisect import bisect_left, bisect_right, insort
+from operator import itemgetter
+from typing import Any
+
+_value_of = itemgetter(0)
+
+
+class SortedIndex:
+    """Sorted (value, entity_id) pairs of a column for equality and range lookups
+
+    New pairs are buffered and merged into the sorted entries on the next lookup, so loading
+    a table costs one sort instead of one list insertion per row. None values are not indexed.
+    """
+
+    def __init__(self):
+        self._entries = []  # type: list[tuple[Any, int | str]]
+        self._pending = []  # type: list[tuple[Any, int | str]]
+
+    def add(self, value: Any, entity_id: int | str):
+        if value is not None:
+            self._pending.append((value, entity_id))
+
+    def remove(self, value: Any, entity_id: int | str):
+        if value is None:
+            return
+        if (value, entity_id) in self._pending:
+            self._pending.remove((value, entity_id))
+            return
+        self._merge()
+        for position in range(bisect_left(self._entries, value, key=_value_of), len(self._entries)):
+            entry = self._entries[position]
+            if entry[0] != value:
+                break
+            if entry[1] == entity_id:
+                del self._entries[position]
+                return
+
+    def clear(self):
+        self._entries = []
+        self._pending = []
+
+    def bounds(self, low: Any = None, high: Any = None, include_low: bool = True,
+               include_high: bool = True) -> tuple[int, int]:
+        """Positions of the entries between low and high, None means unbounded"""
+
+        self._merge()
+        start, end = 0, len(self._entries)
+        if low is not None:
+            search = bisect_left if include_low else bisect_right
+            start = search(self._entries, low, key=_value_of)
+        if high is not None:
+            search = bisect_right if include_high else bisect_left
+            end = search(self._entries, high, key=_value_of)
+        return start, max(start, end)
+
+    def count(self, low: Any = None, high: Any = None, include_low: bool = True, include_high: bool = True) -> int:
+        start, end = self.bounds(low, high, include_low, include_high)
+        return end - start
+
+    def find(self, low: Any = None, high: Any = None, include_low: bool = True,
+             include_high: bool = True) -> list[int | str]:
+        start, end = self.bounds(low, high, include_low, include_high)
+        return [entity_id for _, entity_id in self._entries[start:end]]
+
+    def _merge(self):
+        if not self._pending:
+            return
+        # Merged into a new list so a TypeError on mixed value types leaves the index unchanged
+        if len(self._pending) < 16:
+            entries = list(self._entries)
+            for entry in self._pending:
+                insort(entries, entry, key=_value_of)
+        else:
+            entries = sorted(self._entries + self._pending, key=_value_of)
+        self._entries, self._pending = entries, []
+
+    def __len__(self) -> int:
+        return len(self._entries) + len(self._pending)
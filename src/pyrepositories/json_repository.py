@@ -1,103 +1,427 @@
-from typing import Any
-from .datatable import DataTable
+from typing import Iterator
+from .datatable import DataTable, projected
 from jsonservice import JsonService
-from .lib import Entity, IdTypes, EntityField, FieldBase, Filter
+from .lib import Entity, FieldBase, Filter, Schema, RowDecoder
+from .cache import LRUCache
+from .codec import Codec, get_codec
+from .concurrency import FileLock, reading, writing
+from .ids import FileIdSequence, IdSequence
+from .metrics import current_metrics
+from contextlib import contextmanager
+from enum import Enum
+import json
 import os
 
 
 def convert_to_entity(data: dict, fields: list[FieldBase]) -> Entity | None:
-    if 'id' not in data:
-        raise ValueError("Entity must have an id")
-
-    fields_dict = {field.name: field for field in fields}
-    entity_fields = []
-    for key, field in fields_dict.items():
-        entity_fields.append(EntityField(field, data.get(key)))
-    entity = Entity(entity_fields, data['id'])
-    if entity.validate():
-        return entity
+    return RowDecoder(Schema.of(fields)).decode(data)
+
+
+class _CodecService(JsonService):
+    """JsonService storing its document with a Codec
+
+    The file is replaced instead of rewritten, so readers never see a half written file.
+    """
+
+    def __init__(self, path: str, codec: Codec, create_if_not_exists: bool = True):
+        if not os.path.exists(path) and not create_if_not_exists:
+            raise FileNotFoundError(f"The given table file does not exist ({path})")
+
+        self._json_path = path
+        self.codec = codec
+        self._data = codec.load(path) if os.path.exists(path) and os.path.getsize(path) else {}
+
+    def write(self, path: str, value):
+        keys = path.split('.')
+        target = self._data
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = value
+        size = self.codec.save(self._json_path, self._data)
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.file_writes += 1
+            metrics.bytes_written += size
+
 
-    entity.print_errors()
-    return None
+class JsonStorageModes(Enum):
+    SNAPSHOT = 0
+    LOG = 1
 
 
 class JsonTable(DataTable):
-    def __init__(self, name: str, store_path: str, fields: list[FieldBase], create_if_not_exists: bool = True):
+    """Table stored as a single JSON file
+
+    With cached=True the rows are kept in memory keyed by id and decoded entities are kept in
+    an LRU cache (unbounded unless cache_size is given). Writes go to both the cache and the file.
+    Entities returned in cached mode are shared, use update() to persist changes made to them.
+
+    With storage_mode=JsonStorageModes.LOG every mutation is appended to <name>.log.jsonl as a single
+    record instead of rewriting <name>.json. The log is replayed on open and compacted into the
+    snapshot once it holds more than compact_threshold records and more records than the table has rows.
+
+    Rows are validated when they are written and decoded without validation when read. With lazy=True
+    the returned entities keep the raw row and only decode the fields that are accessed.
+
+    The file is stored with the given codec (a Codec or its name, 'json' or 'msgpack'). JSON is written with
+    orjson when it is installed, msgpack stores the field names once instead of in every row.
+    The file is named <name>.<codec extension>, use codec.convert_file to change the format of a table.
+
+    Tables can be shared between threads and processes. Readers run in parallel and writers are
+    serialized by a reader-writer lock in the process and an advisory lock on <file>.lock
+    across processes. The snapshot is replaced atomically, and the rows and field indexes are
+    reloaded when another process changed the files since they were last read.
+    """
+
+    def __init__(self, name: str, store_path: str, fields: list[FieldBase], create_if_not_exists: bool = True,
+                 cached: bool = False, cache_size: int | None = None,
+                 storage_mode: JsonStorageModes = JsonStorageModes.SNAPSHOT, compact_threshold: int = 1000,
+                 lazy: bool = False, codec: Codec | str | None = None):
         super().__init__(name, fields)
-        file_path = os.path.join(store_path, f'{name}.json')
-        self.json_service = JsonService(file_path, create_if_not_exists=create_if_not_exists)
-        current_content = self.json_service.read('content')
+        self._decoder = RowDecoder(self.schema, lazy)
+        self.codec = get_codec(codec)
+        self.file_path = os.path.join(store_path, f'{name}.{self.codec.extension}')
+        self.create_if_not_exists = create_if_not_exists
+        self.json_service = None  # type: JsonService | None
+        self.cached = cached
+        self._cache = LRUCache(cache_size)
+        self._rows = None  # type: dict[int | str, dict] | None
+        self.storage_mode = storage_mode
+        self.compact_threshold = compact_threshold
+        self.log_path = os.path.join(store_path, f'{name}.log.jsonl')
+        self._log_records = 0
+        self._file_lock = FileLock(f'{self.file_path}.lock')
+        self._disk_state = None  # type: tuple | None
 
-        if not current_content:
-            self.json_service.write('content', [])
-            current_content = []
+        with self._lock.write(), self._file_lock.exclusive():
+            self._reload()
 
-        self._refresh_fields()
+    def read_lock(self):
+        return self._locked(write=False)
 
+    def write_lock(self):
+        return self._locked(write=True)
+
+    @projected
+    @reading
     def get_all(self):
-        content = self.json_service.read('content') or []
-        entities = []
-        for item in content:
-            entities.append(convert_to_entity(item, self.field_structure))
+        metrics = current_metrics()
+        if self.cached:
+            rows = self._get_rows()
+            if metrics is not None:
+                metrics.rows_scanned += len(rows)
+            return [self._decode(item) for item in rows.values()]
+
+        decode = self._decoder.decode
+        content = self._content()
+        if metrics is not None:
+            metrics.rows_scanned += len(content)
+            metrics.entities_decoded += len(content)
+        return [decode(item) for item in content]
 
-        return entities
+    def iter_all(self) -> Iterator[Entity]:
+        """Decode the rows one at a time, writes made while iterating are not seen"""
 
+        with self.read_lock():
+            rows = list(self._get_rows().values()) if self.cached else list(self._content())
+        decode = self._decode if self.cached else self._decoder.decode
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.rows_scanned += len(rows)
+            if not self.cached:
+                metrics.entities_decoded += len(rows)
+        for item in rows:
+            entity = decode(item)
+            if entity is not None:
+                yield entity
+
+    @projected
+    @reading
     def get_by_id(self, entity_id: int | str) -> Entity | None:
-        content = self.json_service.read('content') or []
-        for item in content:
+        if self.cached:
+            item = self._get_rows().get(entity_id)
+            return self._decode(item) if item is not None else None
+
+        content = self._content()
+        metrics = current_metrics()
+        for position, item in enumerate(content):
             if item['id'] == entity_id:
-                return convert_to_entity(item, self.field_structure)
+                if metrics is not None:
+                    metrics.rows_scanned += position + 1
+                    metrics.entities_decoded += 1
+                return self._decoder.decode(item)
+        if metrics is not None:
+            metrics.rows_scanned += len(content)
         return None
 
-    def get_unique(self, key: str, value: Any) -> Entity | None:
-        field_value = self._get_unique(key, value)
-        if not field_value:
-            return None
+    @reading
+    def _get_by_ids(self, entity_ids: list[int | str]) -> list[Entity]:
+        if self.cached:
+            rows = self._get_rows()
+            return [entity for entity in (self._decode(rows[entity_id]) for entity_id in entity_ids
+                                          if entity_id in rows) if entity]
 
-        entity = self.get_by_id(field_value.entity_id)
-        if not entity:
-            return None
-        return entity
+        wanted = set(entity_ids)
+        content = self._content()
+        items = {item['id']: item for item in content if item['id'] in wanted}
+        entities = [self._decoder.decode(items[entity_id]) for entity_id in entity_ids
+                    if entity_id in items]
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.rows_scanned += len(content)
+            metrics.entities_decoded += len(entities)
+        return [entity for entity in entities if entity]
+
+    @reading
+    def count(self, filters: Filter | None = None) -> int:
+        if filters is None:
+            return len(self._get_rows()) if self.cached else len(self._content())
+        return super().count(filters)
 
-    def insert(self, data: Entity) -> Entity | None:
-        result = super().insert(data)
-        if not result:
-            return None
-        content = self.json_service.read('content') or []
-        content.append(result.serialize())
+    @writing
+    def clear(self):
+        for field in self.fields.values():
+            field.clear()
+        self.json_service.write('content', [])
+        if self.storage_mode == JsonStorageModes.LOG:
+            self._truncate_log()
+        self._rows = None
+        self._cache.clear()
+        self._changed()
+        return True
+
+    @writing
+    def compact(self):
+        """Write the current rows into the snapshot file and empty the log"""
+
+        content = self._content()
         self.json_service.write('content', content)
-        return result
+        self._truncate_log()
 
-    def insert_many(self, data: list[Entity]) -> list[Entity] | None:
-        results = []
-        for entity in data:
-            result = self.insert(entity)
-            if not result:
-                return None
-            results.append(result)
-        return results
-
-    def update(self, entity_id, data: Entity) -> Entity | None:
-        result = super().update(entity_id, data)
-        if not result:
-            return None
-        content = self.json_service.read('content') or []  # type: list[dict]
-        for index, item in enumerate(content):
-            if item['id'] == entity_id:
-                content[index] = result.serialize()
-                self.json_service.write('content', content)
-                return result
+    def _get_ids(self):
+        if self.cached:
+            return self._get_rows().keys()
+        return {item['id'] for item in self._content()}
+
+    def _write_batch(self, inserts: list[Entity], updates: list[Entity], deletes: list[int | str]):
+        content = self._content()
+        records = []
+        if updates or deletes:
+            replaced = {entity.id: entity.serialize() for entity in updates}
+            removed = set(deletes)
+            content[:] = [replaced.get(item['id'], item) for item in content if item['id'] not in removed]
+            records.extend({'op': 'update', 'row': item} for item in replaced.values())
+            records.extend({'op': 'delete', 'id': entity_id} for entity_id in deletes)
+        for entity in inserts:
+            item = entity.serialize()
+            content.append(item)
+            records.append({'op': 'insert', 'row': item})
+        self._save(content, records)
+
+        for entity_id in deletes:
+            self._uncache_row(entity_id)
+        for record in records:
+            if record['op'] != 'delete':
+                self._cache_row(record['row'])
+
+    def _iter_values(self, names: list[str], filters: Filter | None) -> Iterator[tuple]:
+        with self.read_lock():
+            candidates = None if filters is None else self._get_candidate_ids(filters)
+            if self.cached:
+                stored = self._get_rows()
+                rows = list(stored.values()) if candidates is None else \
+                    [stored[entity_id] for entity_id in candidates if entity_id in stored]
+                scanned = len(rows)
+            else:
+                content = self._content()
+                if candidates is None:
+                    rows = list(content)
+                else:
+                    wanted = set(candidates)
+                    stored = {row['id']: row for row in content if row['id'] in wanted}
+                    rows = [stored[entity_id] for entity_id in candidates if entity_id in stored]
+                scanned = len(content)
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.rows_scanned += scanned
+        values = self._decoder.values_of(names)
+        if filters is None:
+            for row in rows:
+                yield values(row)
+            return
+        predicate = self._decoder.compile(filters)
+        for row in rows:
+            if predicate(row):
+                yield values(row)
+
+    @reading
+    def _values_by_id(self, entity_id: int | str, names: list[str]) -> tuple | None:
+        if self.cached:
+            row = self._get_rows().get(entity_id)
+            return None if row is None else self._decoder.values_of(names)(row)
+
+        content = self._content()
+        metrics = current_metrics()
+        for position, row in enumerate(content):
+            if row['id'] == entity_id:
+                if metrics is not None:
+                    metrics.rows_scanned += position + 1
+                return self._decoder.values_of(names)(row)
+        if metrics is not None:
+            metrics.rows_scanned += len(content)
         return None
 
-    def delete(self, entity_id: IdTypes) -> bool:
-        content = self.json_service.read('content') or []
-        for index, item in enumerate(content):
-            if item['id'] == entity_id:
-                del content[index]
-                self.json_service.write('content', content)
-                return True
-        return False
+    def _raw_rows(self) -> list[dict]:
+        return list(self._get_rows().values()) if self.cached else self._content()
 
-    def clear(self):
-        self.json_service.write('content', [])
-        return True
+    def _decode_row(self, row: dict) -> Entity:
+        return self._decode(row) if self.cached else self._decoder.decode(row)
+
+    def _create_id_sequence(self) -> IdSequence:
+        return FileIdSequence(f'{self.file_path}.seq', self._max_id)
+
+    def _content(self) -> list[dict]:
+        content = self.json_service.read('content')
+        if content is None:
+            self.json_service.write('content', [])
+            content = self.json_service.read('content')
+        return content
+
+    def _save(self, content: list[dict], records: list[dict]):
+        if self.storage_mode != JsonStorageModes.LOG:
+            self.json_service.write('content', content)
+            return
+
+        text = ''.join(json.dumps(record) + '\n' for record in records)
+        with open(self.log_path, 'a') as log_file:
+            log_file.write(text)
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.file_writes += 1
+            metrics.bytes_written += len(text)
+        self._log_records += len(records)
+        if self._log_records > self.compact_threshold and self._log_records > len(content):
+            self.compact()
+
+    @contextmanager
+    def _locked(self, write: bool) -> Iterator[None]:
+        if self._lock.is_held():
+            # Nested call, the file lock is already held and the rows are current
+            with self._lock.write() if write else self._lock.read():
+                yield
+            return
+
+        if write:
+            with self._lock.write(), self._file_lock.exclusive():
+                if self._read_disk_state() != self._disk_state:
+                    self._reload()
+                try:
+                    yield
+                finally:
+                    self._disk_state = self._read_disk_state()
+            return
+
+        while True:
+            with self._lock.read(), self._file_lock.shared():
+                if self._read_disk_state() == self._disk_state:
+                    yield
+                    return
+            # Another process wrote to the table, reloading needs the rows to ourselves
+            with self._lock.write(), self._file_lock.exclusive():
+                if self._read_disk_state() != self._disk_state:
+                    self._reload()
+
+    def _read_disk_state(self) -> tuple:
+        """Identifies the file contents, the snapshot gets a new inode on every write and the log grows"""
+
+        def state(path: str):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return None
+            return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+        if self.storage_mode == JsonStorageModes.LOG:
+            return state(self.file_path), state(self.log_path)
+        return state(self.file_path),
+
+    def _reload(self):
+        self.json_service = _CodecService(self.file_path, self.codec, create_if_not_exists=self.create_if_not_exists)
+        metrics = current_metrics()
+        if metrics is not None:
+            # A new table has no files yet, nothing was read
+            paths = [self.file_path] + ([self.log_path] if self.storage_mode == JsonStorageModes.LOG else [])
+            for path in paths:
+                if os.path.exists(path):
+                    metrics.file_reads += 1
+                    metrics.bytes_read += os.path.getsize(path)
+        if not self.json_service.read('content'):
+            self.json_service.write('content', [])
+        self._rows = None
+        self._cache.clear()
+        self._log_records = 0
+        if self.storage_mode == JsonStorageModes.LOG:
+            self._replay_log()
+        self._refresh_fields()
+        self._changed()
+        self._disk_state = self._read_disk_state()
+
+    def _replay_log(self):
+        if not os.path.exists(self.log_path):
+            return
+
+        content = self._content()
+        rows = {item['id']: item for item in content}
+        torn = False
+        with open(self.log_path, 'r') as log_file:
+            for line in log_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn last line from an interrupted append, everything before it is intact
+                    torn = True
+                    break
+                if record['op'] == 'delete':
+                    rows.pop(record['id'], None)
+                else:
+                    rows[record['row']['id']] = record['row']
+                self._log_records += 1
+
+        content[:] = rows.values()
+        if torn or self._log_records > self.compact_threshold:
+            self.compact()
+
+    def _truncate_log(self):
+        open(self.log_path, 'w').close()
+        self._log_records = 0
+
+    def _get_rows(self) -> dict[int | str, dict]:
+        if self._rows is None:
+            content = self._content()
+            self._rows = {item['id']: item for item in content}
+        return self._rows
+
+    def _decode(self, item: dict) -> Entity | None:
+        entity = self._cache.get(item['id'])
+        if entity is None:
+            metrics = current_metrics()
+            if metrics is not None:
+                metrics.entities_decoded += 1
+            entity = self._decoder.decode(item)
+            if entity is not None:
+                self._cache.put(item['id'], entity)
+        return entity
+
+    def _cache_row(self, item: dict):
+        if not self.cached:
+            return
+        self._get_rows()[item['id']] = item
+        entity = self._decoder.decode(item)
+        if entity is not None:
+            self._cache.put(item['id'], entity)
+
+    def _uncache_row(self, entity_id: int | str):
+        if not self.cached:
+            return
+        self._get_rows().pop(entity_id, None)
+        self._cache.pop(entity_id)
@@ -1,5 +1,8 @@
-from typing import Any
+from typing import Any, Callable, Iterator
 from enum import Enum
+import operator
+import weakref
+from .index import SortedIndex
 
 
 class IdTypes(Enum):
@@ -51,12 +54,98 @@ class FilterCombination(Enum):
     OR = 1
 
 
+_COMPARISONS = {
+    FilterTypes.EQUAL: operator.eq,
+    FilterTypes.NOT_EQUAL: operator.ne,
+    FilterTypes.GREATER_THAN: operator.gt,
+    FilterTypes.LESS_THAN: operator.lt,
+    FilterTypes.GREATER_THAN_OR_EQUAL: operator.ge,
+    FilterTypes.LESS_THAN_OR_EQUAL: operator.le,
+}
+
+
+def _freeze(value: Any) -> Any:
+    """A hashable form of a filter value, raises TypeError for values that can not be hashed"""
+
+    if isinstance(value, list):
+        return list, tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return dict, frozenset((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, set):
+        return set, frozenset(value)
+    hash(value)
+    return value
+
+
 class FilterCondition:
     def __init__(self, key: str, value: Any, filter_type: FilterTypes = FilterTypes.EQUAL):
         self.key = key
         self.value = value
         self.filter_type = filter_type
 
+    def matches_every(self, default: Any = None) -> bool:
+        """Whether the condition matches every entity holding the field, given the default of the field
+
+        Empty values (None, '' and []) and the default of the field are not compared, every backend follows this rule.
+        """
+
+        value = self.value
+        return value is None or value == '' or value == [] or value == default
+
+    def compile(self) -> Callable[[Any], bool]:
+        """Build a predicate on entities with the same result as Entity.matches_condition"""
+
+        key, value = self.key, self.value
+        if self.matches_every():
+            return lambda entity: key in entity._schema.positions
+
+        test = self.compile_test()
+
+        def predicate(entity) -> bool:
+            entry = entity._schema.lookup.get(key)
+            if entry is None:
+                return False
+            position, default = entry
+            if value == default:
+                return True
+            return test(entity._values[position])
+
+        return predicate
+
+    def compile_test(self) -> Callable[[Any], bool]:
+        """Predicate on a single field value, without the empty value and default handling of compile()"""
+
+        value, filter_type = self.value, self.filter_type
+        if filter_type in _COMPARISONS:
+            compare = _COMPARISONS[filter_type]
+            return lambda field_value: compare(field_value, value)
+        if filter_type == FilterTypes.IN and isinstance(value, list):
+            return lambda field_value: field_value in value
+        if filter_type == FilterTypes.NOT_IN and isinstance(value, list):
+            return lambda field_value: field_value not in value
+        if filter_type == FilterTypes.IS_NULL:
+            return lambda field_value: field_value is None
+        if filter_type == FilterTypes.IS_NOT_NULL:
+            return lambda field_value: field_value is not None
+        if filter_type in (FilterTypes.LIKE, FilterTypes.CONTAINS):
+            return lambda field_value: value in field_value
+        if filter_type in (FilterTypes.NOT_LIKE, FilterTypes.NOT_CONTAINS):
+            return lambda field_value: value not in field_value
+        return lambda field_value: False
+
+    def key_tuple(self) -> tuple:
+        """Hashable structure of the condition, equal conditions have equal tuples"""
+
+        return self.key, self.filter_type, _freeze(self.value)
+
+    def __eq__(self, other):
+        if not isinstance(other, FilterCondition):
+            return NotImplemented
+        return self.key_tuple() == other.key_tuple()
+
+    def __hash__(self):
+        return hash(self.key_tuple())
+
     def __str__(self):
         return f"{self.key} {self.filter_type} {self.value}"
 
@@ -67,6 +156,57 @@ class Filter:
     def __init__(self, conditions: list[FilterCondition], combination: FilterCombination = FilterCombination.AND):
         self.conditions = conditions
         self.combination = combination
+        self._predicate = None  # type: Callable[[Any], bool] | None
+        self._compiled_from = None  # type: list[tuple] | None
+
+    def compile(self) -> Callable[[Any], bool]:
+        """Predicate on entities with short-circuit AND/OR, cached until the conditions change"""
+
+        source = [(condition.key, condition.value, condition.filter_type) for condition in self.conditions]
+        source.append(self.combination)
+        if self._predicate is not None and self._compiled_from == source:
+            return self._predicate
+
+        predicate = self.combine([condition.compile() for condition in self.conditions])
+        self._predicate = predicate
+        self._compiled_from = source
+        return predicate
+
+    def combine(self, predicates: list[Callable[[Any], bool]]) -> Callable[[Any], bool]:
+        """Join the predicates of the conditions with the combination of the filter"""
+
+        if self.combination == FilterCombination.AND:
+            if len(predicates) == 1:
+                return predicates[0]
+            if len(predicates) == 2:
+                first, second = predicates
+                return lambda item: first(item) and second(item)
+            return lambda item: all(test(item) for test in predicates)
+        if self.combination == FilterCombination.OR:
+            if len(predicates) == 1:
+                return predicates[0]
+            return lambda item: any(test(item) for test in predicates)
+        raise ValueError(f"Invalid filter combination {self.combination}")
+
+    def __getstate__(self):
+        # The compiled predicate is a closure that can not be pickled, it is rebuilt on first use
+        state = self.__dict__.copy()
+        state['_predicate'] = None
+        state['_compiled_from'] = None
+        return state
+
+    def key_tuple(self) -> tuple:
+        """Hashable structure of the filter, taken when it is used so later changes to the conditions are seen"""
+
+        return self.combination, tuple(condition.key_tuple() for condition in self.conditions)
+
+    def __eq__(self, other):
+        if not isinstance(other, Filter):
+            return NotImplemented
+        return self.key_tuple() == other.key_tuple()
+
+    def __hash__(self):
+        return hash(self.key_tuple())
 
     def __str__(self):
         return f"{self.combination} {self.conditions}"
@@ -108,11 +248,13 @@ class FieldValue:
 
 
 class FieldBase:
-    def __init__(self, name: str, field_type: FieldTypes, key_type: FieldKeyTypes, default: Any = None):
+    def __init__(self, name: str, field_type: FieldTypes, key_type: FieldKeyTypes, default: Any = None,
+                 indexed: bool = False):
         self.name = name
         self.field_type = field_type
         self.key_type = key_type
         self.default = default
+        self.indexed = indexed
 
     def __str__(self):
         return f"{self.name} ({self.field_type}, {self.key_type})"
@@ -126,6 +268,34 @@ class FieldBase:
         }
 
 
+class Schema:
+    """Immutable field layout shared by every entity built from the same FieldBase objects"""
+
+    __slots__ = ('fields', 'positions', 'lookup', '__weakref__')
+    _interned = weakref.WeakValueDictionary()  # type: weakref.WeakValueDictionary[tuple, Schema]
+
+    def __init__(self, fields: tuple[FieldBase, ...]):
+        self.fields = fields
+        self.positions = {}  # type: dict[str, int]
+        for position, field in enumerate(fields):
+            self.positions[field.name] = position
+        self.lookup = {name: (position, fields[position].default) for name, position in self.positions.items()}
+
+    @classmethod
+    def of(cls, fields: list[FieldBase] | tuple[FieldBase, ...]) -> 'Schema':
+        fields = tuple(fields)
+        schema = cls._interned.get(fields)
+        if schema is None:
+            schema = cls(fields)
+            cls._interned[fields] = schema
+        return schema
+
+    def __reduce__(self):
+        return Schema.of, (self.fields,)
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
 
 class TableField:
     def __init__(self, field: FieldBase):
@@ -135,29 +305,108 @@ class TableField:
         self.default = field.default
         if self.key_type == FieldKeyTypes.OPTIONAL and self.default is None:
             raise ValueError(f"Field {self.name} is optional but has no default value")
-        self.values = {}  # type: dict[int | str, FieldValue]
+        self.values = {}  # type: dict[int | str, Any]
+        self.index = {}  # type: dict[Any, int | str]
+        self.sorted_index = SortedIndex() if field.indexed else None
+
+    def is_unique(self) -> bool:
+        return self.key_type == FieldKeyTypes.UNIQUE
 
     def set_value(self, entity_id: int | str, value: Any = None):
         if self.key_type == FieldKeyTypes.REQUIRED and value is None:
             raise ValueError(f"Field {self.name} is required")
 
-        if self.key_type == FieldKeyTypes.UNIQUE:
-            if value in self.values.values():
+        if self.is_unique() and value is not None:
+            owner = self.index.get(value)
+            if owner is not None and owner != entity_id:
                 raise ValueError(f"Value {value} already exists in field {self.name}")
 
-        self.values[entity_id] = FieldValue(value, entity_id)
+        self.remove_value(entity_id)
+        self.values[entity_id] = value
+        if self.is_unique() and value is not None:
+            self.index[value] = entity_id
+        if self.sorted_index is not None:
+            self.sorted_index.add(value, entity_id)
 
     def get_value(self, entity_id: int | str) -> Any | None:
         return self.values.get(entity_id)
 
-    def get_unique(self, value: Any) -> FieldValue | None:
-        if self.key_type != FieldKeyTypes.UNIQUE:
-            raise ValueError(f"Field {self.name} is not unique")
-        for field_value in self.values.values():
-            if field_value.value == value:
-                return field_value
+    def remove_value(self, entity_id: int | str):
+        if entity_id not in self.values:
+            return
+        value = self.values.pop(entity_id)
+        if self.is_unique() and value is not None:
+            if self.index.get(value) == entity_id:
+                del self.index[value]
+        if self.sorted_index is not None:
+            self.sorted_index.remove(value, entity_id)
+
+    def clear(self):
+        self.values = {}
+        self.index = {}
+        if self.sorted_index is not None:
+            self.sorted_index.clear()
+
+    def estimate(self, filter_type: FilterTypes, value: Any) -> int | None:
+        """Number of ids lookup() would return, None when the indexes cannot answer the condition"""
+
+        if self.is_unique() and filter_type in (FilterTypes.EQUAL, FilterTypes.IN):
+            keys = self._lookup_keys(filter_type, value)
+            return None if keys is None else sum(1 for key in keys if key in self.index)
+        ranges = self._lookup_ranges(filter_type, value)
+        if ranges is None:
+            return None
+        return sum(self.sorted_index.count(*bounds) for bounds in ranges)
+
+    def lookup(self, filter_type: FilterTypes, value: Any) -> list[int | str]:
+        if self.is_unique() and filter_type in (FilterTypes.EQUAL, FilterTypes.IN):
+            keys = self._lookup_keys(filter_type, value) or []
+            return [self.index[key] for key in keys if key in self.index]
+        ranges = self._lookup_ranges(filter_type, value) or []
+        entity_ids = []
+        for bounds in ranges:
+            entity_ids.extend(self.sorted_index.find(*bounds))
+        return entity_ids
+
+    def _lookup_keys(self, filter_type: FilterTypes, value: Any) -> list | None:
+        if filter_type == FilterTypes.EQUAL:
+            return [value]
+        if filter_type == FilterTypes.IN and isinstance(value, list):
+            if None in value:
+                # None values are not kept in the unique index and bound nothing in the sorted one
+                return None
+            return list(dict.fromkeys(value))
+        return None
+
+    def _lookup_ranges(self, filter_type: FilterTypes, value: Any) -> list[tuple] | None:
+        if self.sorted_index is None:
+            return None
+        if filter_type in (FilterTypes.EQUAL, FilterTypes.IN):
+            keys = self._lookup_keys(filter_type, value)
+            return None if keys is None else [(key, key, True, True) for key in keys]
+        if filter_type == FilterTypes.GREATER_THAN:
+            return [(value, None, False, True)]
+        if filter_type == FilterTypes.GREATER_THAN_OR_EQUAL:
+            return [(value, None, True, True)]
+        if filter_type == FilterTypes.LESS_THAN:
+            return [(None, value, True, False)]
+        if filter_type == FilterTypes.LESS_THAN_OR_EQUAL:
+            return [(None, value, True, True)]
         return None
 
+    def find(self, value: Any) -> int | str | None:
+        """Id of the entity holding the value of a unique field"""
+
+        if not self.is_unique():
+            raise ValueError(f"Field {self.name} is not unique")
+        return self.index.get(value)
+
+    def get_unique(self, value: Any) -> FieldValue | None:
+        entity_id = self.find(value)
+        if entity_id is None:
+            return None
+        return FieldValue(self.values.get(entity_id), entity_id)
+
     def serialize(self) -> dict[str, tuple]:
         return {
             self.name: (self.field_type, self.key_type, self.default)
@@ -168,12 +417,11 @@ class TableField:
 
 
 class EntityField:
+    __slots__ = ('field', 'value')
+
     def __init__(self, field: FieldBase, value: Any = None):
+        self.field = field
         self.value = value
-        self.name = field.name
-        self.field_type = field.field_type
-        self.key_type = field.key_type
-        self.default = field.default
 
         if self.key_type == FieldKeyTypes.OPTIONAL and self.default is None:
             raise ValueError(f"Field {self.name} is optional but has no default value")
@@ -184,15 +432,90 @@ class EntityField:
         if self.key_type < FieldKeyTypes.STANDARD and self.value is None:
             raise ValueError(f"Field {self.name} is required but has no value")
 
+    @classmethod
+    def of(cls, field: FieldBase, value: Any) -> 'EntityField':
+        """Wrap a stored value without applying the default or validating it"""
+
+        entity_field = cls.__new__(cls)
+        entity_field.field = field
+        entity_field.value = value
+        return entity_field
+
+    @property
+    def name(self) -> str:
+        return self.field.name
+
+    @name.setter
+    def name(self, name: str):
+        self._replace_field(name=name)
+
+    @property
+    def field_type(self) -> FieldTypes:
+        return self.field.field_type
+
+    @field_type.setter
+    def field_type(self, field_type: FieldTypes):
+        self._replace_field(field_type=field_type)
+
+    @property
+    def key_type(self) -> FieldKeyTypes:
+        return self.field.key_type
+
+    @key_type.setter
+    def key_type(self, key_type: FieldKeyTypes):
+        self._replace_field(key_type=key_type)
+
+    @property
+    def default(self) -> Any:
+        return self.field.default
+
+    @default.setter
+    def default(self, default: Any):
+        self._replace_field(default=default)
+
     def serialize(self) -> dict[str, tuple]:
         return {
             self.name: (self.field_type, self.key_type, self.default)
         }
 
+    def _replace_field(self, **changes):
+        # The FieldBase may be shared with a table and its other entities, it is copied instead of changed
+        field = self.field
+        attributes = {'name': field.name, 'field_type': field.field_type, 'key_type': field.key_type,
+                      'default': field.default, 'indexed': field.indexed}
+        attributes.update(changes)
+        self.field = FieldBase(**attributes)
+
     def __str__(self):
         return f"{self.name} ({self.field_type}, {self.key_type})"
 
 
+class _BoundEntityField(EntityField):
+    """Field returned by Entity.get_field, reads and writes go through to the entity"""
+
+    __slots__ = ('_entity', '_position')
+
+    @classmethod
+    def bind(cls, entity: 'Entity', position: int) -> '_BoundEntityField':
+        bound = cls.__new__(cls)
+        bound.field = entity.get_schema().fields[position]
+        bound._entity = entity
+        bound._position = position
+        return bound
+
+    @property
+    def value(self) -> Any:
+        return self._entity._values[self._position]
+
+    @value.setter
+    def value(self, value: Any):
+        self._entity._values[self._position] = value
+
+    def _replace_field(self, **changes):
+        super()._replace_field(**changes)
+        self._entity._replace_schema_field(self._position, self.field)
+
+
 class Error:
     def __init__(self, message: str):
         self.message = message
@@ -205,37 +528,87 @@ class Error:
 
 
 class Entity:
+    """A row of a table, the values are kept in a list laid out by a Schema shared with the other rows"""
+
+    __slots__ = ('id', '_schema', '_values', '_errors')
+
     def __init__(self, fields: list[EntityField], id: int | str | None = None):
         self.id = id
-        self.__fields = {}  # type: dict[str, EntityField]
-        for field in fields:
-            self.__fields[field.name] = field
-        self.errors = []  # type: list[Error]
+        self._schema = Schema.of([field.field for field in fields])
+        self._values = [field.value for field in fields]
+        self._errors = None  # type: list[Error] | None
+
+    @classmethod
+    def from_values(cls, schema: Schema, values: list[Any], id: int | str | None = None) -> 'Entity':
+        """Build an entity from values already in schema order, without EntityField objects"""
+
+        entity = cls.__new__(cls)
+        entity.id = id
+        entity._schema = schema
+        entity._values = values
+        entity._errors = None
+        return entity
+
+    @property
+    def errors(self) -> list[Error]:
+        if self._errors is None:
+            self._errors = []
+        return self._errors
+
+    @errors.setter
+    def errors(self, errors: list[Error]):
+        self._errors = errors
+
+    def get_schema(self) -> Schema:
+        return self._schema
 
     def add_field(self, name: str, field: EntityField):
-        self.__fields[name] = field
+        position = self._schema.positions.get(name)
+        fields = list(self._schema.fields)
+        if position is None:
+            fields.append(field.field)
+            self._values.append(field.value)
+        else:
+            fields[position] = field.field
+            self._values[position] = field.value
+        self._schema = Schema.of(fields)
+
+    def has_field(self, name: str) -> bool:
+        return name in self._schema.positions
 
     def get_field(self, name: str) -> EntityField | None:
-        return self.__fields.get(name)
+        position = self._schema.positions.get(name)
+        if position is None:
+            return None
+        return _BoundEntityField.bind(self, position)
 
     def get_field_value(self, name: str) -> Any:
-        return self.__fields[name].value
+        return self._values[self._schema.positions[name]]
 
     def set_field_value(self, name: str, value: Any):
-        self.__fields[name].value = value
+        self._values[self._schema.positions[name]] = value
+
+    def copy(self) -> 'Entity':
+        return Entity.from_values(self._schema, list(self._values), self.id)
+
+    def get_field_items(self) -> Iterator[tuple[str, Any]]:
+        values = self._values
+        return ((name, values[position]) for name, position in self._schema.positions.items())
 
     def get_fields(self):
-        fields = []
-        for field in self.__fields.values():
-            fields.append(field)
-        return fields
+        return [_BoundEntityField.bind(self, position) for position in self._schema.positions.values()]
+
+    def _replace_schema_field(self, position: int, field: FieldBase):
+        fields = list(self._schema.fields)
+        fields[position] = field
+        self._schema = Schema.of(fields)
 
     def matches_condition(self, key: str, value: Any, filter_type: FilterTypes) -> bool:
         field = self.get_field(key)
         if not field:
             return False
 
-        if value == field.default or value is None or value == '' or value == []:
+        if FilterCondition(key, value, filter_type).matches_every(field.default):
             return True
 
         if filter_type == FilterTypes.EQUAL:
@@ -264,24 +637,14 @@ class Entity:
             return value not in field.value
 
     def matches_criteria(self, filter: Filter) -> bool:
-        results = []
-        for condition in filter.conditions:
-            results.append(self.matches_condition(condition.key, condition.value, condition.filter_type))
-
-        if filter.combination == FilterCombination.AND:
-            return all(results)
-        if filter.combination == FilterCombination.OR:
-            return any(results)
-
-        raise ValueError(f"Invalid filter combination {filter.combination}")
-                
+        return bool(filter.compile()(self))
 
     def has_value(self, filter: Filter) -> bool:
         return self.matches_criteria(filter)
 
     def validate(self) -> bool:
-        for field in self.__fields.values():
-            if field.key_type < FieldKeyTypes.STANDARD and field.value is None:
+        for field, value in zip(self._schema.fields, self._values):
+            if field.key_type < FieldKeyTypes.STANDARD and value is None:
                 self.errors.append(Error(f"Field {field.name} is required"))
                 return False
         return True
@@ -293,10 +656,9 @@ class Entity:
     def serialize(self) -> dict[str, Any]:
         data = {}
         data['id'] = self.id
-        for field in self.__fields.values():
-            data[field.name] = field.value
+        data.update(self.get_field_items())
         return data
- 
+
     def __str__(self):
         return str(self.serialize())
 
@@ -304,9 +666,92 @@ class Entity:
         return self.__str__()
 
 
+class RowDecoder:
+    """Turns stored rows (dicts keyed by field name) into entities of one schema
+
+    Rows are trusted as they were validated when written. With lazy=True the entities keep the raw
+    row and only decode the values that are read.
+    """
+
+    def __init__(self, schema: Schema, lazy: bool = False):
+        self.schema = schema
+        self.lazy = lazy
+        self.columns = [(field.name, field.default) for field in schema.fields]
+        self.defaults = {name: default for name, default in self.columns}
+
+    def decode(self, row: dict) -> Entity:
+        if 'id' not in row:
+            raise ValueError("Entity must have an id")
+        if self.lazy:
+            return LazyEntity.from_row(self, row)
+        return Entity.from_values(self.schema, self.decode_values(row), row['id'])
+
+    def decode_values(self, row: dict) -> list[Any]:
+        get = row.get
+        return [default if (value := get(name)) is None else value for name, default in self.columns]
+
+    def values_of(self, names: list[str]) -> Callable[[dict], tuple]:
+        """A function reading the given fields ('id' for the id) of a row into a tuple, without building an entity"""
+
+        columns = [(name, None if name == 'id' else self.defaults[name]) for name in names]
+
+        def values(row: dict) -> tuple:
+            get = row.get
+            return tuple([default if (value := get(name)) is None else value for name, default in columns])
+
+        return values
+
+    def compile(self, filters: Filter) -> Callable[[dict], bool]:
+        """Predicate on stored rows with the same result as filters.compile() on the decoded entities"""
+
+        return filters.combine([self._compile_condition(condition) for condition in filters.conditions])
+
+    def _compile_condition(self, condition: FilterCondition) -> Callable[[dict], bool]:
+        entry = self.schema.lookup.get(condition.key)
+        if entry is None:
+            return lambda row: False
+        default = entry[1]
+        if condition.matches_every(default):
+            return lambda row: True
+        key, test = condition.key, condition.compile_test()
+        return lambda row: test(default if (value := row.get(key)) is None else value)
+
+    def decode_value(self, row: dict, name: str) -> Any:
+        default = self.defaults[name]
+        value = row.get(name)
+        return default if value is None else value
+
+
+class LazyEntity(Entity):
+    """Entity over a raw row, the values are decoded the first time they are all needed"""
+
+    __slots__ = ('_row', '_decoder')
+
+    @classmethod
+    def from_row(cls, decoder: RowDecoder, row: dict) -> 'LazyEntity':
+        entity = cls.__new__(cls)
+        entity.id = row['id']
+        entity._schema = decoder.schema
+        entity._errors = None
+        entity._row = row
+        entity._decoder = decoder
+        return entity
+
+    def __getattr__(self, name: str) -> Any:
+        # Only reached while the _values slot is still unset
+        if name == '_values':
+            values = self._decoder.decode_values(self._row)
+            self._values = values
+            self._row = None
+            return values
+        raise AttributeError(name)
+
+    def get_field_value(self, name: str) -> Any:
+        if self._row is not None and self._schema is self._decoder.schema:
+            return self._decoder.decode_value(self._row, name)
+        return super().get_field_value(name)
+
+
 def filter_by_fields(data: list[Entity], filter: Filter) -> list[Entity]:
-    result = []
-    for item in data:
-        if item.has_value(filter):
-            result.append(item)
-    return result
+    predicate = filter.compile()
+    return [item for item in data if predicate(item)]
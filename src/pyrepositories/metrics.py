@@ -0,0 +1,171 @@
+from bisect import bisect_left
+from functools import wraps
+from typing import Any, Callable
+import threading
+import time
+
+_current = threading.local()
+
+# Upper bounds of the latency histogram buckets in milliseconds, the last bucket is unbounded
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class OperationMetrics:
+    """What a single table operation did, counters that do not apply to a backend stay 0"""
+
+    __slots__ = ('table', 'operation', 'latency', 'rows_scanned', 'rows_returned', 'entities_decoded',
+                 'file_reads', 'file_writes', 'bytes_read', 'bytes_written')
+
+    def __init__(self, table: str, operation: str):
+        self.table = table
+        self.operation = operation
+        self.latency = 0.0  # seconds
+        self.rows_scanned = 0
+        self.rows_returned = 0
+        self.entities_decoded = 0
+        self.file_reads = 0
+        self.file_writes = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def __repr__(self):
+        counters = ', '.join(f'{name}={getattr(self, name)}' for name in self.__slots__[2:])
+        return f'OperationMetrics({self.table}.{self.operation}, {counters})'
+
+
+class Observer:
+    """Receives the metrics of every table operation, set it on a DataSource or a DataTable
+
+    Tables only measure their operations when the observer is enabled.
+    """
+
+    enabled = True
+
+    def record(self, metrics: OperationMetrics):
+        pass
+
+
+class NullObserver(Observer):
+    """The default observer, operations run without being measured"""
+
+    enabled = False
+
+
+NULL_OBSERVER = NullObserver()
+
+
+class MetricsAggregator(Observer):
+    """Aggregates the metrics per table and operation in process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}  # type: dict[tuple[str, str], dict[str, Any]]
+
+    def record(self, metrics: OperationMetrics):
+        latency_ms = metrics.latency * 1000
+        with self._lock:
+            aggregate = self._operations.get((metrics.table, metrics.operation))
+            if aggregate is None:
+                aggregate = {name: 0 for name in OperationMetrics.__slots__[3:]}
+                aggregate.update(count=0, latency_ms=0.0, max_latency_ms=0.0,
+                                 histogram=[0] * (len(LATENCY_BUCKETS) + 1))
+                self._operations[(metrics.table, metrics.operation)] = aggregate
+            aggregate['count'] += 1
+            aggregate['latency_ms'] += latency_ms
+            aggregate['max_latency_ms'] = max(aggregate['max_latency_ms'], latency_ms)
+            aggregate['histogram'][bisect_left(LATENCY_BUCKETS, latency_ms)] += 1
+            for name in OperationMetrics.__slots__[3:]:
+                aggregate[name] += getattr(metrics, name)
+
+    def snapshot(self) -> dict[str, dict[str, dict[str, Any]]]:
+        """Totals, latency percentiles and histogram per table and operation
+
+        Percentiles are the upper bound of the histogram bucket they fall into.
+        """
+
+        with self._lock:
+            operations = {key: dict(value, histogram=list(value['histogram']))
+                          for key, value in self._operations.items()}
+
+        snapshot = {}
+        for (table, operation), aggregate in sorted(operations.items()):
+            histogram = aggregate.pop('histogram')
+            count = aggregate['count']
+            aggregate['mean_latency_ms'] = aggregate['latency_ms'] / count
+            for percentile in (50, 95, 99):
+                aggregate[f'p{percentile}_latency_ms'] = _percentile(histogram, count, percentile,
+                                                                     aggregate['max_latency_ms'])
+            aggregate['histogram'] = {_bucket_name(index): bucket_count for index, bucket_count in enumerate(histogram)}
+            snapshot.setdefault(table, {})[operation] = aggregate
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._operations = {}
+
+
+def _bucket_name(index: int) -> str:
+    return f'<={LATENCY_BUCKETS[index]}' if index < len(LATENCY_BUCKETS) else f'>{LATENCY_BUCKETS[-1]}'
+
+
+def _percentile(histogram: list[int], count: int, percentile: int, maximum: float) -> float:
+    rank = count * percentile / 100
+    seen = 0
+    for index, bucket_count in enumerate(histogram):
+        seen += bucket_count
+        if seen >= rank:
+            return min(LATENCY_BUCKETS[index], maximum) if index < len(LATENCY_BUCKETS) else maximum
+    return maximum
+
+
+def current_metrics() -> OperationMetrics | None:
+    """The metrics of the operation running on this thread, None when it is not measured"""
+
+    return getattr(_current, 'metrics', None)
+
+
+def _count_rows(operation: str, result: Any) -> int:
+    if operation == 'aggregate':
+        return 1
+    if result is None or result is False:
+        return 0
+    if operation == 'get_by_id':
+        # One entity, or one projected row as a dict
+        return 1
+    if isinstance(result, bool):
+        return 1
+    if isinstance(result, int):
+        return result
+    if isinstance(result, (list, tuple, dict)):
+        return len(result)
+    return 1
+
+
+def instrumented(operation: str) -> Callable[[Callable], Callable]:
+    """Report the calls of a table method to the observer of the table
+
+    Nested operations, e.g. the get_by_id inside get_unique, are counted as part of the outer one.
+    """
+
+    def decorator(method: Callable) -> Callable:
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            observer = self.observer
+            if not observer.enabled or getattr(_current, 'metrics', None) is not None:
+                return method(self, *args, **kwargs)
+
+            metrics = OperationMetrics(self.name, operation)
+            _current.metrics = metrics
+            start = time.perf_counter()
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                metrics.latency = time.perf_counter() - start
+                _current.metrics = None
+            metrics.rows_returned = _count_rows(operation, result)
+            observer.record(metrics)
+            return result
+
+        wrapper.instrumented = True
+        return wrapper
+    return decorator
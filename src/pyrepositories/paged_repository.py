@@ -0,0 +1,233 @@
+from typing import Any, Container, Iterator
+from .datatable import DataTable, projected
+from .lib import Entity, FieldBase, Filter, FieldValue, RowDecoder
+from .codec import JsonCodec
+from .concurrency import atomic_write, paused_gc, reading, writing
+from .metrics import current_metrics
+from .pagefile import PageFile
+from .ids import FileIdSequence, IdSequence
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PagedTable(DataTable):
+    """Table stored as records in fixed-size pages of a memory-mapped file, <name>.pages
+
+    The location of every record, id -> (page, offset, length), is kept in <name>.index. Opening
+    a table only reads the index, and a point lookup decodes the single record it needs, the kernel
+    pages the data file in on demand. Updated records are written to a new location and the old
+    one is reused once the index points away from it, so the index never refers to a half written record.
+
+    Every batch appends one line to the index, which is compacted once it holds more than
+    compact_threshold lines and more lines than the table has rows. The page size of an existing
+    table is read from its index. The field indexes are built on the first lookup that needs them.
+
+    Tables can be shared between threads, the files must not be opened by another process at the same time.
+    """
+
+    def __init__(self, name: str, store_path: str, fields: list[FieldBase], page_size: int = 4096,
+                 compact_threshold: int = 1000, lazy: bool = False):
+        super().__init__(name, fields)
+        self._decoder = RowDecoder(self.schema, lazy)
+        self._codec = JsonCodec()
+        self.page_path = os.path.join(store_path, f'{name}.pages')
+        self.index_path = os.path.join(store_path, f'{name}.index')
+        self.compact_threshold = compact_threshold
+        self._index = {}  # type: dict[int | str, tuple[int, int, int]]
+        self._index_records = 0
+        self._fields_loaded = False
+        self._fields_lock = threading.Lock()
+
+        # Loading allocates a few objects per record, collecting in between only slows it down
+        with paused_gc():
+            page_size = self._load_index(page_size)
+            self.pages = PageFile(self.page_path, page_size)
+            self.pages.load(self._index.values())
+
+    @projected
+    @reading
+    def get_all(self) -> list[Entity]:
+        return [self._read(location) for location in self._index.values()]
+
+    def iter_all(self) -> Iterator[Entity]:
+        """Decode the records one at a time, records deleted while iterating are skipped"""
+
+        with self.read_lock():
+            entity_ids = list(self._index)
+        for entity_id in entity_ids:
+            with self.read_lock():
+                location = self._index.get(entity_id)
+                entity = self._read(location) if location is not None else None
+            if entity is not None:
+                yield entity
+
+    @projected
+    @reading
+    def get_by_id(self, entity_id: int | str) -> Entity | None:
+        location = self._index.get(entity_id)
+        return self._read(location) if location is not None else None
+
+    @reading
+    def _get_by_ids(self, entity_ids: list[int | str]) -> list[Entity]:
+        index = self._index
+        return [self._read(index[entity_id]) for entity_id in entity_ids if entity_id in index]
+
+    @writing
+    def clear(self):
+        for field in self.fields.values():
+            field.clear()
+        self._index = {}
+        self.pages.clear()
+        self._compact_index()
+        self._changed()
+        return True
+
+    @writing
+    def compact(self):
+        """Rewrite the index as a single line"""
+
+        self._compact_index()
+
+    def close(self):
+        with self.write_lock():
+            self.pages.close()
+
+    def _get_ids(self) -> Container[int | str]:
+        return self._index.keys()
+
+    def _create_id_sequence(self) -> IdSequence:
+        return FileIdSequence(f'{self.index_path}.seq', self._max_id)
+
+    def _iter_values(self, names: list[str], filters: Filter | None) -> Iterator[tuple]:
+        values = self._decoder.values_of(names)
+        predicate = None if filters is None else self._decoder.compile(filters)
+        with self.read_lock():
+            candidates = None if filters is None else self._get_candidate_ids(filters)
+            entity_ids = list(self._index) if candidates is None else candidates
+        for entity_id in entity_ids:
+            with self.read_lock():
+                location = self._index.get(entity_id)
+                row = self._read_row(location) if location is not None else None
+            if row is not None and (predicate is None or predicate(row)):
+                yield values(row)
+
+    @reading
+    def _values_by_id(self, entity_id: int | str, names: list[str]) -> tuple | None:
+        location = self._index.get(entity_id)
+        return None if location is None else self._decoder.values_of(names)(self._read_row(location))
+
+    def _read(self, location: tuple[int, int, int]) -> Entity:
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.entities_decoded += 1
+        return self._decoder.decode(self._read_row(location))
+
+    def _read_row(self, location: tuple[int, int, int]) -> dict:
+        data = self.pages.read(*location)
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.rows_scanned += 1
+            metrics.bytes_read += len(data)
+        return self._codec.decode(data)
+
+    def _write_batch(self, inserts: list[Entity], updates: list[Entity], deletes: list[int | str]):
+        index = self._index
+        released = [index.pop(entity_id) for entity_id in deletes]
+        records = [[entity_id] for entity_id in deletes]
+        written = 0
+        for entity in updates + inserts:
+            data = self._codec.encode(entity.serialize())
+            page, offset = self.pages.allocate(len(data))
+            self.pages.write(page, offset, data)
+            written += len(data)
+            if entity.id in index:
+                released.append(index[entity.id])
+            index[entity.id] = (page, offset, len(data))
+            records.append([entity.id, page, offset, len(data)])
+        self.pages.flush()
+
+        line = self._codec.encode(records) + b'\n'
+        with open(self.index_path, 'ab') as index_file:
+            index_file.write(line)
+        self._index_records += 1
+        # The old locations are only reused once the index no longer refers to them
+        for location in released:
+            self.pages.free(*location)
+
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.file_writes += 2
+            metrics.bytes_written += written + len(line)
+        if self._index_records > max(self.compact_threshold, len(index)):
+            self._compact_index()
+
+    def _load_index(self, page_size: int) -> int:
+        """Read the record locations and return the page size of the table"""
+
+        if not os.path.exists(self.index_path):
+            if os.path.exists(self.page_path):
+                raise ValueError(f"The index of table {self.name} is missing ({self.index_path})")
+            atomic_write(self.index_path, self._codec.encode({'page_size': page_size}) + b'\n')
+            return page_size
+
+        with open(self.index_path, 'rb') as index_file:
+            lines = index_file.read().split(b'\n')
+        page_size = self._codec.decode(lines[0])['page_size']
+        index = self._index
+        torn = False
+        for line in lines[1:]:
+            if not line:
+                continue
+            try:
+                records = self._codec.decode(line)
+            except ValueError:
+                # A batch interrupted while its line was appended, its records were never referenced
+                logger.warning("Table %s: skipping a truncated index record", self.name)
+                torn = True
+                break
+            for record in records:
+                if len(record) == 1:
+                    index.pop(record[0], None)
+                else:
+                    index[record[0]] = tuple(record[1:])
+            self._index_records += 1
+        if torn:
+            self._compact_index(page_size)
+        return page_size
+
+    def _compact_index(self, page_size: int | None = None):
+        if page_size is None:
+            page_size = self.pages.page_size
+        records = [[entity_id, *location] for entity_id, location in self._index.items()]
+        atomic_write(self.index_path, self._codec.encode({'page_size': page_size}) + b'\n' +
+                     self._codec.encode(records) + b'\n')
+        self._index_records = 1
+
+    def _load_fields(self):
+        """Build the field indexes from the records, the first time a lookup needs them"""
+
+        with self._fields_lock:
+            if not self._fields_loaded:
+                self._refresh_fields()
+                self._fields_loaded = True
+
+    def _get_unique(self, field_name: str, value: Any) -> FieldValue | None:
+        self._load_fields()
+        return super()._get_unique(field_name, value)
+
+    def _get_candidate_ids(self, filters: Filter) -> list[int | str] | None:
+        self._load_fields()
+        return super()._get_candidate_ids(filters)
+
+    def _check_unique(self, entities: list[Entity], deletes: list[int | str]):
+        if any(field.is_unique() for field in self.fields.values()):
+            self._load_fields()
+        super()._check_unique(entities, deletes)
+
+    def _index_batch(self, inserts: list[Entity], updates: list[Entity], deletes: list[int | str]):
+        # Field indexes that are not built yet are built from the stored records once they are needed
+        if self._fields_loaded:
+            super()._index_batch(inserts, updates, deletes)
@@ -0,0 +1,150 @@
+from bisect import bisect_left, insort
+from typing import Iterable
+import mmap
+import os
+
+# Pages added at once when the file has to grow, so the file is remapped rarely
+_GROWTH_PAGES = 16
+
+
+class PageFile:
+    """Records stored in fixed-size pages of a memory-mapped file and located by (page, offset, length)
+
+    A record that fits in a page goes into the smallest page gap that holds it, larger records get a
+    run of new pages. Space is only reused once free() is called, so callers free the old location of
+    a record after its new location was persisted. The kernel pages the file in on demand, reading a
+    record only touches the pages it is stored in.
+    """
+
+    def __init__(self, path: str, page_size: int = 4096):
+        if page_size <= 0:
+            raise ValueError("page_size must be a positive integer")
+
+        self.path = path
+        self.page_size = page_size
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self._file = open(path, 'r+b' if exists else 'w+b')
+        if not exists:
+            self._file.truncate(page_size * _GROWTH_PAGES)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self._page_count = 0
+        self._extents = []  # type: list[list[tuple[int, int]]]
+        self._largest = []  # type: list[int]
+        self._gaps = []  # type: list[tuple[int, int]]
+
+    def load(self, locations: Iterable[tuple[int, int, int]]):
+        """Register the records that are already stored, given as (page, offset, length)"""
+
+        extents = {}  # type: dict[int, list[tuple[int, int]]]
+        page_size = self.page_size
+        for page, offset, length in locations:
+            if offset + length <= page_size:
+                page_extents = extents.get(page)
+                if page_extents is None:
+                    page_extents = extents[page] = []
+                page_extents.append((offset, offset + length))
+                continue
+            for current, start, end in self._spans(page, offset, length):
+                extents.setdefault(current, []).append((start, end))
+        page_count = max(extents, default=-1) + 1
+        self._ensure_size(page_count)
+        self._page_count = page_count
+        self._extents = [sorted(extents.get(page, ())) for page in range(page_count)]
+        self._largest = [self._largest_gap(page) for page in range(page_count)]
+        self._gaps = sorted((largest, page) for page, largest in enumerate(self._largest))
+
+    def allocate(self, length: int) -> tuple[int, int]:
+        if length > self.page_size:
+            page = self._page_count
+            self._add_pages(page + -(-length // self.page_size))
+            for current, start, end in self._spans(page, 0, length):
+                self._occupy(current, start, end)
+            return page, 0
+
+        position = bisect_left(self._gaps, (length, -1))
+        if position < len(self._gaps):
+            page = self._gaps[position][1]
+        else:
+            page = self._page_count
+            self._add_pages(page + 1)
+        offset = self._find_gap(page, length)
+        self._occupy(page, offset, offset + length)
+        return page, offset
+
+    def free(self, page: int, offset: int, length: int):
+        for current, start, end in self._spans(page, offset, length):
+            extents = self._extents[current]
+            del extents[bisect_left(extents, (start, end))]
+            self._update_largest(current)
+
+    def write(self, page: int, offset: int, data: bytes):
+        start = page * self.page_size + offset
+        self._mmap[start:start + len(data)] = data
+
+    def read(self, page: int, offset: int, length: int) -> bytes:
+        start = page * self.page_size + offset
+        return self._mmap[start:start + length]
+
+    def flush(self):
+        self._mmap.flush()
+
+    def clear(self):
+        self._mmap.close()
+        self._file.truncate(self.page_size * _GROWTH_PAGES)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self._page_count = 0
+        self._extents, self._largest, self._gaps = [], [], []
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def _spans(self, page: int, offset: int, length: int):
+        if offset + length <= self.page_size:
+            yield page, offset, offset + length
+            return
+        for index in range(-(-length // self.page_size)):
+            yield page + index, 0, min(self.page_size, length - index * self.page_size)
+
+    def _add_pages(self, page_count: int):
+        if page_count <= self._page_count:
+            return
+        self._ensure_size(page_count)
+        for page in range(self._page_count, page_count):
+            self._extents.append([])
+            self._largest.append(self.page_size)
+            insort(self._gaps, (self.page_size, page))
+        self._page_count = page_count
+
+    def _ensure_size(self, page_count: int):
+        if page_count * self.page_size > len(self._mmap):
+            size = max(page_count, len(self._mmap) // self.page_size + _GROWTH_PAGES) * self.page_size
+            self._mmap.close()
+            self._file.truncate(size)
+            self._mmap = mmap.mmap(self._file.fileno(), 0)
+
+    def _occupy(self, page: int, start: int, end: int):
+        insort(self._extents[page], (start, end))
+        self._update_largest(page)
+
+    def _find_gap(self, page: int, length: int) -> int:
+        position = 0
+        for start, end in self._extents[page]:
+            if start - position >= length:
+                return position
+            position = end
+        return position
+
+    def _largest_gap(self, page: int) -> int:
+        largest, position = 0, 0
+        for start, end in self._extents[page]:
+            largest = max(largest, start - position)
+            position = end
+        return max(largest, self.page_size - position)
+
+    def _update_largest(self, page: int):
+        largest = self._largest_gap(page)
+        if largest != self._largest[page]:
+            del self._gaps[bisect_left(self._gaps, (self._largest[page], page))]
+            insort(self._gaps, (largest, page))
+            self._largest[page] = largest
@@ -0,0 +1,66 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from .lib import FieldBase, Filter, RowDecoder, Schema
+import os
+import threading
+
+
+def _match_chunk(fields: list[FieldBase], filters: list[Filter], rows: list[dict]) -> list[int]:
+    """Positions of the rows matching any of the filters, runs in a worker process"""
+
+    decode = RowDecoder(Schema.of(fields)).decode
+    predicates = [filter.compile() for filter in filters]
+    if len(predicates) == 1:
+        predicate = predicates[0]
+        return [position for position, row in enumerate(rows) if predicate(decode(row))]
+    return [position for position, row in enumerate(rows)
+            if any(predicate(entity) for entity in (decode(row),) for predicate in predicates)]
+
+
+class ParallelScanner:
+    """Decodes and filters the rows of full table scans in a pool of worker processes
+
+    Set it as the scanner of a DataSource or a DataTable. Scans of tables with fewer than threshold rows
+    stay serial, larger ones are split into chunks_per_worker chunks per worker. The matches come back
+    in the order the serial scan returns them. Only backends holding their rows as dicts in memory,
+    JsonTable, are scanned in parallel. The worker processes are started on the first parallel scan.
+    """
+
+    def __init__(self, max_workers: int | None = None, threshold: int = 50_000, chunks_per_worker: int = 4):
+        if threshold < 0 or chunks_per_worker <= 0:
+            raise ValueError("threshold must not be negative and chunks_per_worker must be positive")
+
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.threshold = threshold
+        self.chunks_per_worker = chunks_per_worker
+        self._executor = None  # type: ProcessPoolExecutor | None
+        self._lock = threading.Lock()
+
+    def match(self, fields: list[FieldBase], rows: list[dict], filters: list[Filter]) -> list[int] | None:
+        """Positions of the rows matching any of the filters, None when the rows are too few to scan in parallel"""
+
+        if len(rows) < self.threshold or not rows:
+            return None
+        size = -(-len(rows) // (self.max_workers * self.chunks_per_worker))
+        starts = range(0, len(rows), size)
+        chunks = (rows[start:start + size] for start in starts)
+        results = self._pool().map(partial(_match_chunk, fields, filters), chunks)
+        return [start + position for start, positions in zip(starts, results) for position in positions]
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.max_workers)
+            return self._executor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,310 @@
+from typing import Any, Container, Iterator
+from .datatable import DataTable, cached_query, projected
+from .lib import Entity, FieldBase, Filter, FilterCombination, FilterTypes, TableField
+from .json_repository import JsonTable
+from .cache import LRUCache
+from .concurrency import atomic_write, reading, writing
+from .ids import FileIdSequence, IdSequence
+import json
+import os
+import threading
+import zlib
+
+
+def _shard_of(value: Any, shard_count: int) -> int:
+    # Numbers that compare equal go to the same shard, 1, 1.0 and True are all hashed as 1
+    if isinstance(value, bool) or (isinstance(value, float) and value.is_integer()):
+        value = int(value)
+    # repr is stable between processes, unlike hash() of strings
+    return zlib.crc32(repr(value).encode('utf-8')) % shard_count
+
+
+class ShardedTable(DataTable):
+    """Table spread over shard files, each one a JsonTable holding the rows whose key hashes to it
+
+    Rows are placed by the hash of their id, or by the value of partition_key when it is given. A write
+    only rewrites the shards it touches. With id placement get_by_id opens the one shard that owns the id,
+    with a partition key get_by_filter only scans the shards an equality or IN condition on the key can match.
+    Results are returned shard by shard, not in insertion order.
+
+    Shards are opened when they are first needed and at most max_open_shards are kept open, so scans
+    with iter_all only hold a few shards in memory. The remaining keyword arguments are passed to
+    every shard, e.g. codec or storage_mode. The layout is stored in <name>.shards.json, reopening a table
+    uses it, use reshard() to change it.
+
+    Unique fields are checked across all shards. A batch touching several shards is written shard by shard,
+    it is not atomic across shards.
+    """
+
+    def __init__(self, name: str, store_path: str, fields: list[FieldBase], shards: int | None = None,
+                 partition_key: str | None = None, max_open_shards: int | None = None, **shard_options):
+        super().__init__(name, fields)
+        self.store_path = store_path
+        self.shard_options = shard_options
+        self.layout_path = os.path.join(store_path, f'{name}.shards.json')
+        self._open = LRUCache(max_open_shards)
+        self._open_lock = threading.Lock()
+
+        if os.path.exists(self.layout_path):
+            with open(self.layout_path) as layout_file:
+                layout = json.load(layout_file)
+            if shards is not None and shards != layout['shards']:
+                raise ValueError(f"Table {name} has {layout['shards']} shards, use reshard() to change it")
+            if partition_key is not None and partition_key != layout['partition_key']:
+                raise ValueError(f"Table {name} is partitioned by {layout['partition_key']}, "
+                                 f"use reshard() to change it")
+            self.shard_count = layout['shards']
+            self.partition_key = layout['partition_key']
+            self.generation = layout['generation']
+        else:
+            self._check_layout(8 if shards is None else shards, partition_key)
+            self.shard_count = 8 if shards is None else shards
+            self.partition_key = partition_key
+            self.generation = 0
+            self._save_layout()
+
+    @projected
+    @reading
+    def get_all(self) -> list[Entity]:
+        return [entity for index in range(self.shard_count) for entity in self._shard(index).get_all()]
+
+    def iter_all(self) -> Iterator[Entity]:
+        """Yield the entities one shard at a time"""
+
+        for index in range(self.shard_count):
+            yield from self._shard(index).iter_all()
+
+    @projected
+    @reading
+    def get_by_id(self, entity_id: int | str) -> Entity | None:
+        if self.partition_key is None:
+            return self._shard(_shard_of(entity_id, self.shard_count)).get_by_id(entity_id)
+        for index in range(self.shard_count):
+            entity = self._shard(index).get_by_id(entity_id)
+            if entity is not None:
+                return entity
+        return None
+
+    @reading
+    def _get_by_ids(self, entity_ids: list[int | str]) -> list[Entity]:
+        if self.partition_key is not None:
+            return [entity for entity in map(self.get_by_id, entity_ids) if entity]
+        groups = {}  # type: dict[int, list[int | str]]
+        for entity_id in entity_ids:
+            groups.setdefault(_shard_of(entity_id, self.shard_count), []).append(entity_id)
+        found = {entity.id: entity for index, group in groups.items()
+                 for entity in self._shard(index)._get_by_ids(group)}
+        return [found[entity_id] for entity_id in entity_ids if entity_id in found]
+
+    @reading
+    def get_unique(self, key: str, value: Any) -> Entity | None:
+        for index in self._shards_holding(key, value):
+            entity = self._shard(index).get_unique(key, value)
+            if entity is not None:
+                return entity
+        return None
+
+    @projected
+    @cached_query
+    @reading
+    def get_by_filter(self, filters: Filter) -> list[Entity]:
+        return [entity for index in self._shards_for(filters) for entity in self._shard(index).get_by_filter(filters)]
+
+    @cached_query
+    @reading
+    def get_by_filters(self, filters: list[Filter]) -> list[Entity]:
+        indexes = sorted({index for filter in filters for index in self._shards_for(filter)})
+        return [entity for index in indexes for entity in self._shard(index).get_by_filters(filters)]
+
+    @reading
+    def count(self, filters: Filter | None = None) -> int:
+        indexes = range(self.shard_count) if filters is None else self._shards_for(filters)
+        return sum(self._shard(index).count(filters) for index in indexes)
+
+    @writing
+    def clear(self):
+        for index in range(self.shard_count):
+            self._shard(index).clear()
+        self._changed()
+        return True
+
+    @writing
+    def reshard(self, shards: int, partition_key: str | None = None):
+        """Move the rows into a new set of shard files, placed by id or by partition_key
+
+        Resharding is offline, no other process may use the table meanwhile. The rows are read one
+        shard at a time and the new shards are kept open until they are written. The old files are
+        removed once the new layout is stored.
+        """
+
+        self._check_layout(shards, partition_key)
+        generation = self.generation + 1
+        targets = [self._open_shard(generation, index) for index in range(shards)]
+        for index in range(self.shard_count):
+            buckets = {}  # type: dict[int, list[Entity]]
+            for entity in self._shard(index).iter_all():
+                target = _shard_of(self._placement_value(entity, partition_key), shards)
+                buckets.setdefault(target, []).append(entity)
+            for target, entities in buckets.items():
+                targets[target].insert_many(entities)
+
+        previous = [self._open_shard(self.generation, index) for index in range(self.shard_count)]
+        self.shard_count, self.partition_key, self.generation = shards, partition_key, generation
+        self._save_layout()
+        with self._open_lock:
+            self._open.clear()
+        for shard in previous:
+            for path in (shard.file_path, f'{shard.file_path}.lock', shard.log_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        self._changed()
+
+    def _iter_matches(self, filters: Filter | None) -> Iterator[Entity]:
+        if filters is None:
+            yield from self.iter_all()
+            return
+        for index in self._shards_for(filters):
+            yield from self._shard(index)._iter_matches(filters)
+
+    def _iter_values(self, names: list[str], filters: Filter | None) -> Iterator[tuple]:
+        indexes = range(self.shard_count) if filters is None else self._shards_for(filters)
+        for index in indexes:
+            yield from self._shard(index)._iter_values(names, filters)
+
+    def _values_by_id(self, entity_id: int | str, names: list[str]) -> tuple | None:
+        if self.partition_key is None:
+            return self._shard(_shard_of(entity_id, self.shard_count))._values_by_id(entity_id, names)
+        for index in range(self.shard_count):
+            values = self._shard(index)._values_by_id(entity_id, names)
+            if values is not None:
+                return values
+        return None
+
+    def _get_ids(self) -> Container[int | str]:
+        ids = set()
+        for index in range(self.shard_count):
+            ids.update(self._shard(index)._get_ids())
+        return ids
+
+    def _find_existing(self, entity_ids: list[int | str]) -> set[int | str]:
+        return set(self._locate(entity_ids))
+
+    def _create_id_sequence(self) -> IdSequence:
+        return FileIdSequence(os.path.join(self.store_path, f'{self.name}.seq'), self._max_id)
+
+    def _write_batch(self, inserts: list[Entity], updates: list[Entity], deletes: list[int | str]):
+        located = self._locate([entity.id for entity in updates] + list(deletes))
+        batches = {}  # type: dict[int, tuple[list[Entity], list[Entity], list[int | str]]]
+
+        def batch(index: int):
+            return batches.setdefault(index, ([], [], []))
+
+        for entity in inserts:
+            batch(self._shard_for(entity))[0].append(entity)
+        for entity in updates:
+            old, new = located[entity.id], self._shard_for(entity)
+            if old == new:
+                batch(new)[1].append(entity)
+            else:
+                # The partition key changed, the row moves to the shard of its new value
+                batch(old)[2].append(entity.id)
+                batch(new)[0].append(entity)
+        for entity_id in deletes:
+            batch(located[entity_id])[2].append(entity_id)
+
+        for index in sorted(batches):
+            self._shard(index)._apply_batch(*batches[index])
+
+    def _index_batch(self, inserts: list[Entity], updates: list[Entity], deletes: list[int | str]):
+        # The shards index their own rows
+        pass
+
+    def _owner_of(self, field: TableField, value: Any) -> int | str | None:
+        for index in self._shards_holding(field.name, value):
+            field_value = self._shard(index)._get_unique(field.name, value)
+            if field_value is not None:
+                return field_value.entity_id
+        return None
+
+    def _get_candidate_ids(self, filters: Filter) -> list[int | str] | None:
+        # The field indexes live in the shards
+        return None
+
+    def _shards_holding(self, key: str, value: Any) -> list[int] | range:
+        """The shards that can hold a value of the key, only one when the table is partitioned by it"""
+
+        return [_shard_of(value, self.shard_count)] if key == self.partition_key else range(self.shard_count)
+
+    def _locate(self, entity_ids: list[int | str]) -> dict[int | str, int]:
+        """The shard of every given id that is stored in the table"""
+
+        located = {}
+        if self.partition_key is None:
+            groups = {}  # type: dict[int, list[int | str]]
+            for entity_id in entity_ids:
+                groups.setdefault(_shard_of(entity_id, self.shard_count), []).append(entity_id)
+            for index, group in groups.items():
+                located.update(dict.fromkeys(self._shard(index)._find_existing(group), index))
+            return located
+
+        remaining = list(dict.fromkeys(entity_ids))
+        for index in range(self.shard_count):
+            if not remaining:
+                break
+            found = self._shard(index)._find_existing(remaining)
+            located.update(dict.fromkeys(found, index))
+            remaining = [entity_id for entity_id in remaining if entity_id not in found]
+        return located
+
+    def _shards_for(self, filters: Filter) -> list[int]:
+        """The shards that can hold entities matching the filter"""
+
+        every = list(range(self.shard_count))
+        if self.partition_key is None:
+            return every
+        if filters.combination != FilterCombination.AND and len(filters.conditions) != 1:
+            return every
+        default = self.fields[self.partition_key].default
+        for condition in filters.conditions:
+            if condition.key != self.partition_key or condition.matches_every(default):
+                continue
+            if condition.filter_type == FilterTypes.EQUAL:
+                values = [condition.value]
+            elif condition.filter_type == FilterTypes.IN and isinstance(condition.value, list):
+                values = condition.value
+            else:
+                continue
+            return sorted({_shard_of(value, self.shard_count) for value in values})
+        return every
+
+    def _shard_for(self, entity: Entity) -> int:
+        return _shard_of(self._placement_value(entity, self.partition_key), self.shard_count)
+
+    def _placement_value(self, entity: Entity, partition_key: str | None) -> Any:
+        if partition_key is None:
+            return entity.id
+        value = entity.get_field_value(partition_key) if entity.has_field(partition_key) else None
+        # Stored rows read back missing values as the default
+        return self.fields[partition_key].default if value is None else value
+
+    def _shard(self, index: int) -> JsonTable:
+        with self._open_lock:
+            shard = self._open.get(index)
+            if shard is None:
+                shard = self._open_shard(self.generation, index)
+                self._open.put(index, shard)
+            return shard
+
+    def _open_shard(self, generation: int, index: int) -> JsonTable:
+        return JsonTable(f'{self.name}.{generation}.{index}', self.store_path, self.field_structure,
+                         **self.shard_options)
+
+    def _check_layout(self, shards: int, partition_key: str | None):
+        if shards <= 0:
+            raise ValueError("shards must be a positive integer")
+        if partition_key is not None and partition_key not in self.fields:
+            raise ValueError(f"Partition key {partition_key} is not a field of table {self.name}")
+
+    def _save_layout(self):
+        layout = {'shards': self.shard_count, 'partition_key': self.partition_key, 'generation': self.generation}
+        atomic_write(self.layout_path, json.dumps(layout))
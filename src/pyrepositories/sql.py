@@ -0,0 +1,182 @@
+from typing import Any
+from .lib import FieldBase, FieldKeyTypes, FieldTypes, Filter, FilterCondition, FilterCombination, FilterTypes
+
+
+def _comparable(field: FieldBase, value: Any) -> bool:
+    """Whether the engine compares the value like Python would, e.g. SQLite compares 5 and '5' as equal in a TEXT column"""
+
+    if field.field_type in (FieldTypes.STR, FieldTypes.UUID):
+        return isinstance(value, str)
+    return isinstance(value, (int, float, bool))
+
+
+class SqlDialect:
+    """Placeholder, quoting and type differences between SQL engines"""
+
+    placeholder = '?'
+    column_types = {
+        FieldTypes.INT: 'INTEGER',
+        FieldTypes.FLOAT: 'REAL',
+        FieldTypes.STR: 'TEXT',
+        FieldTypes.UUID: 'TEXT',
+        FieldTypes.BOOL: 'INTEGER',
+        FieldTypes.LIST: 'TEXT',
+        FieldTypes.DICT: 'TEXT',
+    }
+    id_type = ''
+
+    def quote(self, identifier: str) -> str:
+        return '"' + identifier.replace('"', '""') + '"'
+
+    def contains(self, column: str) -> str:
+        return f"instr({column}, {self.placeholder}) > 0"
+
+
+class SqliteDialect(SqlDialect):
+    pass
+
+
+class PostgresDialect(SqlDialect):
+    placeholder = '%s'
+    column_types = {
+        FieldTypes.INT: 'BIGINT',
+        FieldTypes.FLOAT: 'DOUBLE PRECISION',
+        FieldTypes.STR: 'TEXT',
+        FieldTypes.UUID: 'TEXT',
+        FieldTypes.BOOL: 'BOOLEAN',
+        FieldTypes.LIST: 'JSONB',
+        FieldTypes.DICT: 'JSONB',
+    }
+    id_type = 'TEXT'
+
+    def contains(self, column: str) -> str:
+        return f"strpos({column}, {self.placeholder}) > 0"
+
+
+class SqlCompiler:
+    """Builds parameterized SQL for a table described by FieldBase definitions
+
+    Filters are compiled with the same results as Entity.matches_condition. Conditions that can not
+    be expressed in SQL (e.g. on LIST or DICT fields) are reported back so the caller can check them in Python.
+    """
+
+    def __init__(self, table_name: str, fields: list[FieldBase], dialect: SqlDialect | None = None):
+        self.dialect = dialect or SqliteDialect()
+        self.fields = {field.name: field for field in fields}
+        self.table = self.dialect.quote(table_name)
+        self.columns = [self.dialect.quote(field.name) for field in fields]
+        self.table_name = table_name
+
+    def create_table(self) -> list[str]:
+        quote = self.dialect.quote
+        id_type = f" {self.dialect.id_type}" if self.dialect.id_type else ''
+        definitions = [f"{quote('id')}{id_type} PRIMARY KEY"]
+        for field in self.fields.values():
+            definitions.append(f"{quote(field.name)} {self.dialect.column_types[field.field_type]}")
+        statements = [f"CREATE TABLE IF NOT EXISTS {self.table} ({', '.join(definitions)})"]
+        for field in self.fields.values():
+            if field.key_type == FieldKeyTypes.UNIQUE or field.indexed:
+                unique = 'UNIQUE ' if field.key_type == FieldKeyTypes.UNIQUE else ''
+                index = quote(f"{self.table_name}_{field.name}_index")
+                statements.append(f"CREATE {unique}INDEX IF NOT EXISTS {index} ON {self.table} ({quote(field.name)})")
+        return statements
+
+    def select(self, columns: str | None = None) -> str:
+        columns = columns or ', '.join([self.dialect.quote('id')] + self.columns)
+        return f"SELECT {columns} FROM {self.table}"
+
+    def insert(self) -> str:
+        columns = ', '.join([self.dialect.quote('id')] + self.columns)
+        placeholders = ', '.join([self.dialect.placeholder] * (len(self.columns) + 1))
+        return f"INSERT INTO {self.table} ({columns}) VALUES ({placeholders})"
+
+    def update(self) -> str:
+        assignments = ', '.join(f"{column} = {self.dialect.placeholder}" for column in self.columns)
+        return f"UPDATE {self.table} SET {assignments} WHERE {self.dialect.quote('id')} = {self.dialect.placeholder}"
+
+    def clear_columns(self, names: list[str]) -> str:
+        """UPDATE statement setting the given columns of a row to NULL"""
+
+        assignments = ', '.join(f"{self.dialect.quote(name)} = NULL" for name in names)
+        return f"UPDATE {self.table} SET {assignments} WHERE {self.dialect.quote('id')} = {self.dialect.placeholder}"
+
+    def delete(self) -> str:
+        return f"DELETE FROM {self.table} WHERE {self.dialect.quote('id')} = {self.dialect.placeholder}"
+
+    def where_in(self, column: str, count: int) -> str:
+        placeholders = ', '.join([self.dialect.placeholder] * count)
+        return f"{self.dialect.quote(column)} IN ({placeholders})"
+
+    def compile_filter(self, filters: Filter) -> tuple[str | None, list[Any], bool]:
+        """Returns the WHERE clause (None for every row), its parameters and whether it covers the whole filter"""
+
+        compiled = [self.compile_condition(condition) for condition in filters.conditions]
+        pushed = [clause for clause in compiled if clause is not None]
+        complete = len(pushed) == len(compiled)
+        if filters.combination == FilterCombination.AND:
+            if not pushed:
+                return None, [], complete
+            joiner = ' AND '
+        elif filters.combination == FilterCombination.OR:
+            if not complete:
+                return None, [], False
+            if not pushed:
+                return '0 = 1', [], True
+            joiner = ' OR '
+        else:
+            raise ValueError(f"Invalid filter combination {filters.combination}")
+
+        params = []
+        for _, clause_params in pushed:
+            params.extend(clause_params)
+        return joiner.join(f"({sql})" for sql, _ in pushed), params, complete
+
+    def compile_condition(self, condition: FilterCondition) -> tuple[str, list[Any]] | None:
+        field = self.fields.get(condition.key)
+        if field is None:
+            return '0 = 1', []
+
+        value, filter_type = condition.value, condition.filter_type
+        if condition.matches_every(field.default):
+            return '1 = 1', []
+        if field.field_type in (FieldTypes.LIST, FieldTypes.DICT):
+            return None
+
+        column, placeholder = self.dialect.quote(field.name), self.dialect.placeholder
+        if filter_type in (FilterTypes.IN, FilterTypes.NOT_IN):
+            if not isinstance(value, list):
+                return '0 = 1', []
+            if not all(_comparable(field, item) for item in value):
+                return None
+            placeholders = ', '.join([placeholder] * len(value))
+            if filter_type == FilterTypes.IN:
+                return f"{column} IN ({placeholders})", list(value)
+            return f"{column} NOT IN ({placeholders}) OR {column} IS NULL", list(value)
+        if filter_type == FilterTypes.IS_NULL:
+            return f"{column} IS NULL", []
+        if filter_type == FilterTypes.IS_NOT_NULL:
+            return f"{column} IS NOT NULL", []
+        if not _comparable(field, value):
+            return None
+
+        comparisons = {
+            FilterTypes.EQUAL: '=',
+            FilterTypes.GREATER_THAN: '>',
+            FilterTypes.LESS_THAN: '<',
+            FilterTypes.GREATER_THAN_OR_EQUAL: '>=',
+            FilterTypes.LESS_THAN_OR_EQUAL: '<=',
+        }
+        if filter_type in comparisons:
+            return f"{column} {comparisons[filter_type]} {placeholder}", [value]
+        if filter_type == FilterTypes.NOT_EQUAL:
+            return f"{column} != {placeholder} OR {column} IS NULL", [value]
+        if filter_type in (FilterTypes.LIKE, FilterTypes.CONTAINS) and isinstance(value, str):
+            return self.dialect.contains(column), [value]
+        if filter_type in (FilterTypes.NOT_LIKE, FilterTypes.NOT_CONTAINS) and isinstance(value, str):
+            return f"NOT ({self.dialect.contains(column)})", [value]
+        return None
+
+    def order_by(self, field_name: str, descending: bool = False) -> str:
+        column = self.dialect.quote(field_name)
+        direction = ' DESC' if descending else ''
+        return f" ORDER BY {column} IS NULL, {column}{direction}"
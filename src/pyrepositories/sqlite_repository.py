@@ -0,0 +1,376 @@
+from typing import Any, Callable, Container, Iterator
+from .datatable import DataTable, cached_query, projected
+from .lib import Entity, FieldBase, FieldTypes, FieldValue, Filter, TableField
+from .metrics import current_metrics
+from .concurrency import reading, writing
+from .aggregate import AggregateFunctions, normalize_aggregates
+from .sql import SqlCompiler, SqliteDialect
+from .ids import IdSequence
+import json
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of host parameters of a statement, stay well below the lowest default
+_CHUNK_SIZE = 500
+
+
+def _chunks(items: list, size: int = _CHUNK_SIZE) -> Iterator[list]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SqliteIdSequence(IdSequence):
+    """IdSequence persisted in the pyrepositories_sequences table of the database
+
+    The next id of every table is a row of that table, reserving ids updates it in a transaction so
+    every connection to the database shares the sequence.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, name: str, seed: Callable[[], int]):
+        super().__init__(seed)
+        self.connection = connection
+        self.name = name
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS pyrepositories_sequences "
+                                    "(name TEXT PRIMARY KEY, next INTEGER NOT NULL)")
+
+    def reserve(self, count: int) -> range:
+        with self._lock, self.connection:
+            self._start()
+            self.connection.execute("UPDATE pyrepositories_sequences SET next = next + ? WHERE name = ?",
+                                    [count, self.name])
+            end = self._read()
+        return range(end - count, end)
+
+    def advance(self, entity_id: int):
+        with self._lock, self.connection:
+            self._start()
+            self.connection.execute("UPDATE pyrepositories_sequences SET next = ? WHERE name = ? AND next <= ?",
+                                    [entity_id + 1, self.name, entity_id])
+
+    def _start(self):
+        # The first write of the transaction, it holds the database lock until the sequence is read back
+        self.connection.execute("INSERT OR IGNORE INTO pyrepositories_sequences (name, next) VALUES (?, ?)",
+                                [self.name, self._seed() + 1])
+
+    def _read(self) -> int:
+        return self.connection.execute("SELECT next FROM pyrepositories_sequences WHERE name = ?",
+                                       [self.name]).fetchone()[0]
+
+
+class SqliteTable(DataTable):
+    """Table stored in an SQLite database
+
+    Unique and indexed fields become SQL indexes and filters are compiled to parameterized WHERE clauses,
+    so lookups run inside the engine instead of over every entity in Python. The field indexes of
+    DataTable are not kept in memory for this backend.
+    """
+
+    def __init__(self, name: str, database: str, fields: list[FieldBase], connection: sqlite3.Connection | None = None):
+        super().__init__(name, fields)
+        self.database = database
+        self.connection = connection or sqlite3.connect(database, check_same_thread=False)
+        self.compiler = SqlCompiler(name, fields, SqliteDialect())
+        self._encoders = [self._encoder(field) for field in fields]
+        self._decoders = [self._decoder(field) for field in fields]
+        self._positions = {field.name: position for position, field in enumerate(fields)}
+        if database != ':memory:' and connection is None:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            for statement in self.compiler.create_table():
+                self.connection.execute(statement)
+
+    @projected
+    @reading
+    def get_all(self) -> list[Entity]:
+        return list(self.iter_all())
+
+    def iter_all(self) -> Iterator[Entity]:
+        return self._query()
+
+    @projected
+    @reading
+    def get_by_id(self, entity_id: int | str) -> Entity | None:
+        return next(self._query(self.compiler.where_in('id', 1), [entity_id]), None)
+
+    @projected
+    @cached_query
+    @reading
+    def get_by_filter(self, filters: Filter) -> list[Entity]:
+        return list(self._iter_matches(filters))
+
+    @cached_query
+    @reading
+    def get_by_filters(self, filters: list[Filter]) -> list[Entity]:
+        if not filters:
+            return []
+        compiled = [self.compiler.compile_filter(filter) for filter in filters]
+        if not all(complete for _, _, complete in compiled):
+            return super().get_by_filters(filters)
+        if any(where is None for where, _, _ in compiled):
+            # One of the filters matches every row
+            return self.get_all()
+
+        # The whole OR of the filters runs as one query, rows matching several filters come back once
+        where = ' OR '.join(f"({where})" for where, _, _ in compiled)
+        params = [param for _, filter_params, _ in compiled for param in filter_params]
+        return list(self._query(where, params))
+
+    @reading
+    def count(self, filters: Filter | None = None) -> int:
+        where = self._where(filters)
+        if where is None:
+            return super().count(filters)
+        clause, params = where
+        return self.connection.execute(f"SELECT COUNT(*) FROM {self.compiler.table}{clause}", params).fetchone()[0]
+
+    @reading
+    def aggregate(self, field: str, function: AggregateFunctions | str, filters: Filter | None = None) -> Any:
+        function = AggregateFunctions(function)
+        self._check_aggregates([(field, function)])
+        column, where = self._column(field), self._where(filters)
+        if column is None or where is None:
+            return super().aggregate(field, function, filters)
+        (expression, column_params), (clause, params) = column, where
+        row = self.connection.execute(f"SELECT {function.name}({expression}) FROM {self.compiler.table}{clause}",
+                                      column_params + params).fetchone()
+        return self._aggregate_result(field, function, row[0])
+
+    @reading
+    def group_by(self, field: str, aggregates: dict[str, tuple[str, AggregateFunctions | str]] | None = None,
+                 filters: Filter | None = None) -> dict[Any, dict[str, Any]]:
+        normalized = normalize_aggregates(aggregates)
+        self._check_columns([field])
+        self._check_aggregates([(column, function) for _, column, function in normalized])
+        columns = [self._column(name) for name in [field] + [column for _, column, _ in normalized]]
+        where = self._where(filters)
+        if any(column is None for column in columns) or where is None:
+            return super().group_by(field, aggregates, filters)
+
+        (group, _), clause = columns[0], where[0]
+        selected = [group] + [f"{function.name}({expression})"
+                              for (_, _, function), (expression, _) in zip(normalized, columns[1:])]
+        params = [param for _, column_params in columns for param in column_params] + where[1]
+        cursor = self.connection.execute(f"SELECT {', '.join(selected)} FROM {self.compiler.table}{clause} "
+                                         f"GROUP BY 1", params)
+        decode = (lambda value: value) if field == 'id' else self._decoders[self._positions[field]]
+        return {decode(row[0]): {name: self._aggregate_result(column, function, value)
+                                 for (name, column, function), value in zip(normalized, row[1:])}
+                for row in cursor}
+
+    def iter_by_filter(self, filters: Filter | None = None, limit: int | None = None, offset: int = 0,
+                       order_by: str | None = None, descending: bool = False) -> Iterator[Entity]:
+        where, params, complete = self.compiler.compile_filter(filters) if filters else (None, [], True)
+        if not complete or (order_by is not None and order_by != 'id' and order_by not in self.fields):
+            return super().iter_by_filter(filters, limit, offset, order_by, descending)
+
+        order = ' ORDER BY rowid' if order_by is None else self.compiler.order_by(order_by, descending) + ', rowid'
+        page = ''
+        if limit is not None or offset:
+            page = ' LIMIT ? OFFSET ?'
+            params = params + [-1 if limit is None else limit, offset]
+        return self._query(where, params, order, page)
+
+    @writing
+    def delete_where(self, filters: Filter) -> int:
+        where = self._where(filters)
+        if where is None or self._transaction is not None:
+            return super().delete_where(filters)
+        clause, params = where
+        with self.connection:
+            deleted = self.connection.execute(f"DELETE FROM {self.compiler.table}{clause}", params).rowcount
+        if deleted:
+            self._changed()
+        return deleted
+
+    @writing
+    def clear(self) -> bool:
+        for field in self.fields.values():
+            field.clear()
+        with self.connection:
+            self.connection.execute(f"DELETE FROM {self.compiler.table}")
+        self._changed()
+        return True
+
+    def close(self):
+        self.connection.close()
+
+    def _iter_matches(self, filters: Filter | None) -> Iterator[Entity]:
+        if filters is None:
+            yield from self.iter_all()
+            return
+        where, params, complete = self.compiler.compile_filter(filters)
+        entities = self._query(where, params)
+        if complete:
+            yield from entities
+            return
+        predicate = filters.compile()
+        for entity in entities:
+            if predicate(entity):
+                yield entity
+
+    def _query(self, where: str | None = None, params: list[Any] | None = None, order: str = ' ORDER BY rowid',
+               page: str = '') -> Iterator[Entity]:
+        sql = self.compiler.select() + (f" WHERE {where}" if where else '') + order + page
+        schema, decoders = self.schema, self._decoders
+        metrics = current_metrics()
+        fetched = 0
+        for row in self._fetch(sql, params or []):
+            fetched += 1
+            values = [decode(value) for decode, value in zip(decoders, row[1:])]
+            yield Entity.from_values(schema, values, row[0])
+        if metrics is not None:
+            # The rows the engine examined are not known, count the rows it returned
+            metrics.rows_scanned += fetched
+            metrics.entities_decoded += fetched
+
+    def _fetch(self, sql: str, params: list[Any]) -> Iterator[tuple]:
+        """Rows of the query, fetched in chunks under the read lock so the lock is not held while the caller iterates"""
+
+        with self.read_lock():
+            cursor = self.connection.execute(sql, params)
+        while True:
+            with self.read_lock():
+                rows = cursor.fetchmany(_CHUNK_SIZE)
+            if not rows:
+                return
+            yield from rows
+
+    def _iter_values(self, names: list[str], filters: Filter | None) -> Iterator[tuple]:
+        where = self._where(filters)
+        if where is None:
+            yield from super()._iter_values(names, filters)
+            return
+        clause, params = where
+        yield from self._select_values(names, clause, params)
+
+    @reading
+    def _values_by_id(self, entity_id: int | str, names: list[str]) -> tuple | None:
+        return next(self._select_values(names, f" WHERE {self.compiler.where_in('id', 1)}", [entity_id]), None)
+
+    def _select_values(self, names: list[str], clause: str, params: list[Any]) -> Iterator[tuple]:
+        """Only the given columns of the matching rows, decoded like the entities would see them"""
+
+        columns = ', '.join(self.compiler.dialect.quote(name) for name in names)
+        decoders = [(lambda value: value) if name == 'id' else self._decoders[self._positions[name]] for name in names]
+        metrics = current_metrics()
+        fetched = 0
+        for row in self._fetch(f"{self.compiler.select(columns)}{clause} ORDER BY rowid", params):
+            fetched += 1
+            yield tuple([decode(value) for decode, value in zip(decoders, row)])
+        if metrics is not None:
+            metrics.rows_scanned += fetched
+
+    def _where(self, filters: Filter | None) -> tuple[str, list[Any]] | None:
+        """The WHERE clause of the filter and its parameters, None when it can not run entirely in SQL"""
+
+        if filters is None:
+            return '', []
+        where, params, complete = self.compiler.compile_filter(filters)
+        if not complete:
+            return None
+        return (f" WHERE {where}" if where else ''), params
+
+    def _column(self, name: str) -> tuple[str, list[Any]] | None:
+        """Expression reading a field as the entities see it, None values become the default"""
+
+        quote = self.compiler.dialect.quote
+        if name == 'id':
+            return quote('id'), []
+        field = self.compiler.fields[name]
+        if field.field_type in (FieldTypes.LIST, FieldTypes.DICT):
+            # Stored as JSON text, aggregated in Python
+            return None
+        if field.default is None:
+            return quote(name), []
+        return f"COALESCE({quote(name)}, {self.compiler.dialect.placeholder})", [field.default]
+
+    def _aggregate_result(self, name: str, function: AggregateFunctions, value: Any) -> Any:
+        if function == AggregateFunctions.SUM and value is None:
+            return 0
+        if function in (AggregateFunctions.MIN, AggregateFunctions.MAX) and value is not None and name != 'id':
+            return self._decoders[self._positions[name]](value)
+        return value
+
+    def _row(self, entity: Entity) -> list[Any]:
+        return [encode(entity.get_field_value(field.name) if entity.has_field(field.name) else None)
+                for encode, field in zip(self._encoders, self.field_structure)]
+
+    @reading
+    def _get_ids(self) -> Container[int | str]:
+        return {row[0] for row in self.connection.execute(self.compiler.select(self.compiler.dialect.quote('id')))}
+
+    def _create_id_sequence(self) -> IdSequence:
+        return SqliteIdSequence(self.connection, self.name, self._max_id)
+
+    def _max_id(self) -> int:
+        row = self.connection.execute(f"SELECT MAX({self.compiler.dialect.quote('id')}) FROM {self.compiler.table} "
+                                      f"WHERE typeof({self.compiler.dialect.quote('id')}) = 'integer'").fetchone()
+        return row[0] or 0
+
+    @reading
+    def _find_existing(self, entity_ids: list[int | str]) -> set[int | str]:
+        existing = set()
+        select = self.compiler.select(self.compiler.dialect.quote('id'))
+        for chunk in _chunks(list(dict.fromkeys(entity_ids))):
+            cursor = self.connection.execute(f"{select} WHERE {self.compiler.where_in('id', len(chunk))}", chunk)
+            existing.update(row[0] for row in cursor)
+        return existing
+
+    def _owner_of(self, field: TableField, value: Any) -> int | str | None:
+        field_value = self._get_unique(field.name, value)
+        return field_value.entity_id if field_value else None
+
+    def _index_batch(self, inserts: list[Entity], updates: list[Entity], deletes: list[int | str]):
+        # Uniqueness and lookups are handled by the SQL indexes
+        pass
+
+    def _refresh_fields(self):
+        pass
+
+    def _get_candidate_ids(self, filters: Filter) -> list[int | str] | None:
+        # The field indexes are empty for this backend, so they can not narrow down a scan
+        return None
+
+    @reading
+    def _get_unique(self, field_name: str, value: Any) -> FieldValue | None:
+        field = self.fields.get(field_name)
+        if field is None or not field.is_unique():
+            logger.debug("No record found with %s = %s", field_name, value)
+            return None
+        select = self.compiler.select(self.compiler.dialect.quote('id'))
+        row = self.connection.execute(f"{select} WHERE {self.compiler.where_in(field_name, 1)}", [value]).fetchone()
+        return FieldValue(value, row[0]) if row else None
+
+    def _write_batch(self, inserts: list[Entity], updates: list[Entity], deletes: list[int | str]):
+        with self.connection:
+            if deletes:
+                self.connection.executemany(self.compiler.delete(), [[entity_id] for entity_id in deletes])
+            unique = [field.name for field in self.fields.values() if field.is_unique()]
+            if len(updates) > 1 and unique:
+                # Release the unique values first, the UNIQUE indexes are checked row by row and would
+                # reject entities swapping values within the batch
+                self.connection.executemany(self.compiler.clear_columns(unique), [[entity.id] for entity in updates])
+            if updates:
+                self.connection.executemany(self.compiler.update(),
+                                            [self._row(entity) + [entity.id] for entity in updates])
+            if inserts:
+                self.connection.executemany(self.compiler.insert(),
+                                            [[entity.id] + self._row(entity) for entity in inserts])
+
+    @staticmethod
+    def _encoder(field: FieldBase) -> Callable[[Any], Any]:
+        if field.field_type in (FieldTypes.LIST, FieldTypes.DICT):
+            return lambda value: None if value is None else json.dumps(value)
+        return lambda value: value
+
+    @staticmethod
+    def _decoder(field: FieldBase) -> Callable[[Any], Any]:
+        default = field.default
+        if field.field_type in (FieldTypes.LIST, FieldTypes.DICT):
+            return lambda value: default if value is None else json.loads(value)
+        if field.field_type == FieldTypes.BOOL:
+            return lambda value: default if value is None else bool(value)
+        return lambda value: default if value is None else value
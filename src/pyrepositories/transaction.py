@@ -0,0 +1,90 @@
+from typing import Any
+from .lib import Entity
+
+
+class Transaction:
+    """Buffers the mutations of a table and applies them with a single write when the block exits
+
+    Operations on the same id are folded together, so an insert followed by a delete never reaches
+    the storage and a delete followed by an insert becomes an update.
+    """
+
+    def __init__(self, table: Any):
+        self.table = table
+        self._operations = {}  # type: dict[int | str, tuple[str, Entity | None]]
+
+    def insert(self, data: Entity) -> Entity:
+        if not data.id:
+            raise ValueError("Entity must have an id")
+
+        previous = self._operations.get(data.id)
+        if previous is None:
+            self._operations[data.id] = ('insert', data)
+        elif previous[0] == 'delete':
+            self._operations[data.id] = ('update', data)
+        else:
+            raise ValueError("Entity already exists")
+        return data
+
+    def update(self, entity_id: int | str, data: Entity) -> Entity:
+        data.id = entity_id
+        previous = self._operations.get(entity_id)
+        if previous is not None and previous[0] == 'insert':
+            self._operations[entity_id] = ('insert', data)
+        else:
+            self._operations[entity_id] = ('update', data)
+        return data
+
+    def delete(self, entity_id: int | str) -> bool:
+        return self.delete_many([entity_id]) == 1
+
+    def delete_many(self, entity_ids: list[int | str]) -> int:
+        """Buffer the deletes of the ids that exist in the table or were inserted in the transaction"""
+
+        entity_ids = list(dict.fromkeys(entity_ids))
+        stored = self.table._find_existing([entity_id for entity_id in entity_ids
+                                            if entity_id not in self._operations
+                                            or self._operations[entity_id][0] == 'update'])
+        deleted = 0
+        for entity_id in entity_ids:
+            previous = self._operations.get(entity_id)
+            if previous is not None and previous[0] == 'insert':
+                del self._operations[entity_id]
+            elif entity_id in stored:
+                self._operations[entity_id] = ('delete', None)
+            else:
+                continue
+            deleted += 1
+        return deleted
+
+    def get_inserts(self) -> list[Entity]:
+        return [entity for operation, entity in self._operations.values() if operation == 'insert']
+
+    def commit(self):
+        inserts, updates, deletes = [], [], []
+        for entity_id, (operation, entity) in self._operations.items():
+            if operation == 'insert':
+                inserts.append(entity)
+            elif operation == 'update':
+                updates.append(entity)
+            else:
+                deletes.append(entity_id)
+        self._operations = {}
+        self.table._apply_batch(inserts, updates, deletes)
+
+    def rollback(self):
+        self._operations = {}
+
+    def __enter__(self):
+        if self.table._transaction is not None:
+            raise ValueError(f"A transaction is already in progress on table {self.table.get_name()}")
+        self.table._transaction = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.table._transaction = None
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False